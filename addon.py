@@ -7,6 +7,8 @@ from functions import *
 from torrents import *
 from app import Handler, Link
 from rating import *
+import deadline
+import library
 
 __version__ = "1.8.9"
 __plugin__ = "MyShows.ru " + __version__
@@ -18,15 +20,32 @@ ruName=__settings__.getSetting("ruName")
 change_onclick=__settings__.getSetting("change_onclick")
 cookie_auth=__settings__.getSetting("cookie_auth")
 useTVDB=getSettingAsBool('tvdb')
-socket.setdefaulttimeout(30)
 __addonpath__= __settings__.getAddonInfo('path')
 icon   = __addonpath__+'/icon.png'
 __tmppath__= os.path.join(__addonpath__, 'tmp')
 forced_refresh_data=__settings__.getSetting("forced_refresh_data")
 refresh_period=int('1|4|12|24'.split('|')[int(__settings__.getSetting("refresh_period"))])
 refresh_always=__settings__.getSetting("refresh_always")
+page_size=int('0|25|50|100|200'.split('|')[int(__settings__.getSetting("page_size") or 0)])
 striplist=['the', 'tonight', 'show', 'with', '(2005)', '(2009)', '(2012)', '  ', '  ', '  ', '  ', '  ', '  ', '  ']
+LISTING_MODES=(None, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 25, 27, 28, 40, 41, 100)
+LISTING_DEADLINE=20
+PREFETCH_THREADS=4
+# rows enriched and rendered together while the top list is still being decoded
+TOP_BATCH=25
+WARM_SHOWS=10
+WARM_DELAY=2
+WARM_IDLE=60
+WARM_BUDGET=120
+# разбор html-страниц myshows.ru: отступы описания (до, после, без описания) и регулярка
+ORIG_RECOMM=(u'                        <p class="description">', u'</p>                    </th>', u'                                            </th>')
+RE_RECOMM=re.compile(u'<span class="status .+?"><a href=.+?/view/(\d+?)/">(.+?)</a></span>.+?(^'+ORIG_RECOMM[0]+'.+?'+ORIG_RECOMM[1]+'|'+ORIG_RECOMM[2]+').+?<div style="width: (\d+)%"></div>.+?<td>(\d+)%</td>', re.DOTALL | re.MULTILINE)
+ORIG_FRIENDS=(u'							<p class="description">', u'</p>						</th>', u'                            </th>')
+RE_FRIENDS=re.compile(u'<span class="status .+?"><a href=.+?/view/(\d+?)/">(.+?)</a></span>.+?(^'+ORIG_FRIENDS[0]+'.+?'+ORIG_FRIENDS[1]+'|'+ORIG_FRIENDS[2]+').+?<div style="width: (\d+)%"></div>.+?<td width="\d+?%">(\d+)</td>.+?<td width="\d+?%">([0-9.]+)%</td>', re.DOTALL | re.MULTILINE)
+ORIG_WASTED=(u'                <p class="description">', u'</p>            </th>', u'                            </th>')
+RE_WASTED=re.compile(r'<span class="status .+?"><a href="http://myshows.ru/view/(\d+)/">(.+?)</a></span>.+?(^'+ORIG_WASTED[0]+'.+?'+ORIG_WASTED[1]+'|'+ORIG_WASTED[2]+').+?.+?<div style="width: (\d+)%"></div>.+?<td>\d+</td>.+?<td>(\d+)</td>.+?<td>(.+?)</td>', re.DOTALL | re.MULTILINE)
 Debug('[SYS ARGV]: '+str(urllib.unquote_plus(sys.argv[2]))[1:])
+started=time.time()
 
 check_login = re.search('='+login+';', cookie_auth)
 if not check_login:
@@ -55,6 +74,7 @@ class Main(Handler):
                        {"title":__language__(30146),"mode":"61"}, {"title":__language__(30141),"mode":"510"}])
         if __settings__.getSetting("debug")=='true':
             self.menu.append({"title":"TEST","mode":"999"})
+            self.menu.append({"title":"STATS","mode":"998"})
         self.handle()
         if __settings__.getSetting("autoscan")=='true':
             auto_scan()
@@ -76,6 +96,52 @@ class ExtraFunction(Main):
                           ])
         self.handle()
 
+class Pager:
+    """
+    Cuts a listing into pages of page_size rows, so TVDB enrichment runs
+    only for the rows on screen. The page number travels in the Link argv
+    of the "Next page" item; page_size 0 lists everything at once.
+    """
+
+    def __init__(self, argv=None):
+        self.argv=argv or {}
+        self.size=page_size
+        self.start=page*self.size
+        self.end=self.start+self.size if self.size else None
+        self.more=False
+        self.count=0
+
+    def rows(self, rows, key=None):
+        if key: rows=sorted(rows, key=key)
+        if self.size:
+            self.more=len(rows)>self.end
+            rows=rows[self.start:self.end]
+        return rows
+
+    def visible(self, index):
+        if self.size and index>=self.end:
+            self.more=True
+            return False
+        return index>=self.start
+
+    def add(self, url, item, isFolder=True):
+        if not self.count:
+            Debug('[Pager] mode %s page %d: first item after %.2fs' % (str(mode), page, time.time()-started))
+        self.count+=1
+        xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=url, listitem=item, isFolder=isFolder)
+
+    def done(self):
+        if self.more:
+            argv=dict(self.argv, page=page+1)
+            item = xbmcgui.ListItem(__language__(30344) % (page+2), iconImage='DefaultFolder.png')
+            item.setProperty('SpecialSort', 'bottom')
+            xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=Link(mode, argv).url, listitem=item, isFolder=True)
+        Debug('[Pager] mode %s page %d: %d items after %.2fs' % (str(mode), page, self.count, time.time()-started))
+
+def title_key(title):
+    if isinstance(title, str): title=title.decode('utf-8', 'ignore')
+    return title.lower()
+
 def Shows():
     try: syncshows=SyncXBMC()
     except: syncshows=False
@@ -94,10 +160,8 @@ def Shows():
     else:
         data=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/')
 
-    jload=data.get()
-    if jload:
-        jdata = json.loads(jload)
-    else: return
+    jdata=data.json()
+    if jdata is None: return
 
     #if mode in(11,12):
     #    next_data=json.loads(Data(cookie_auth, 'http://api.myshows.ru/profile/episodes/next/').get())
@@ -119,7 +183,9 @@ def Shows():
             h=Handler(int(sys.argv[1]), link)
             h.item(link, title=unicode(i['title']))
 
-
+    # поиск не листаем: запрос с клавиатуры в ссылку не попадает
+    pager=Pager() if mode!=19 else None
+    rows=[]
     for showId in jdata:
         if ruName=='true' and jdata[showId]['ruTitle']:
             title=jdata[showId]['ruTitle'].encode('utf-8')
@@ -138,42 +204,50 @@ def Shows():
             elif mode!=16 and jdata[showId]['watchStatus']=="cancelled":
                 continue
 
+        rows.append((showId, title))
+    # страницы режем в порядке SORT_METHOD_VIDEO_TITLE, иначе каждая начинается с "А"
+    if pager: rows=pager.rows(rows, key=lambda row: title_key(row[1]))
+
+    index=PrefixIndex([showId for showId, title in rows])
+    for i, (showId, title) in enumerate(rows):
         if mode==19:
             rating=int(jdata[showId]['watching'])
         else:
             rating=float(jdata[showId]['rating'])
-        pre=prefix(showId=int(showId))
+        pre=prefix(showId=int(showId), index=index)
 
         item = xbmcgui.ListItem(pre+title, iconImage='DefaultFolder.png', thumbnailImage=str(jdata[showId]['image']))
         info={'title': title, 'label':title, 'tvshowtitle': jdata[showId]['title'], 'rating': rating*2, 'votes':1, 'year': '', } #'playcount':jdata[showId]['watchedEpisodes'], 'episode':jdata[showId]['totalEpisodes'] НЕ ХОЧУ ГАЛКИ
         try:
             info['plot']=__language__(30265) % (str(jdata[showId]['watchedEpisodes']), str(jdata[showId]['totalEpisodes']))+'\r\n'+__language__(30266)+' '+str(rating)+'\r\n'
         except:info['plot']=''
+        rows[i]=(showId, item, info)
+
+    if syncshows: syncshows.prefetch([info for showId, item, info in rows])
+    for showId, item, info in rows:
         if syncshows: item=syncshows.shows(jdata[showId]['title'], item, info)
         else: item.setInfo( type='Video', infoLabels=info)
         stringdata={"showId":int(showId), "seasonId":None, "episodeId":None, "id":None}
         refresh_url='&refresh_url='+urllib.quote_plus('http://api.myshows.ru/profile/shows/')
         sys_url = sys.argv[0] + '?stringdata='+makeapp(stringdata)+refresh_url+'&showId=' + str(showId) + '&mode=20'
         item.addContextMenuItems(ContextMenuItems(sys_url, refresh_url), True )
-        xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=sys_url, listitem=item, isFolder=True)
+        if pager: pager.add(sys_url, item)
+        else: xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=sys_url, listitem=item, isFolder=True)
+    if pager: pager.done()
 
 def Seasons(showId):
     data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+showId)
+    store().execute('replace into recent(showId, addtime) values(?,?)', (int(showId), int(time.time())))
     try: syncshows=SyncXBMC()
     except: syncshows=False
     saveCheckPoint()
-    seasons, epdict=[], {}
-    jdata = json.loads(data.get())
-    for id in jdata['episodes']:
-        seasonNumber=jdata['episodes'][id]['seasonNumber']
-        if seasonNumber not in seasons:
-            seasons.append(seasonNumber)
-            epdict[str(jdata['episodes'][id]['seasonNumber'])]=str(jdata['episodes'][id]['id'])
-        else:
-            epdict[str(jdata['episodes'][id]['seasonNumber'])]=epdict[str(jdata['episodes'][id]['seasonNumber'])]+','+str(jdata['episodes'][id]['id'])
-    seasons.sort()
+    model = data.model()
+    jdata = model.jdata
+    seasons, epdict=model.seasons(), {}
+    for seasonNumber in seasons:
+        epdict[str(seasonNumber)]=','.join([str(model.episodes[id]['id']) for id in model.by_season[seasonNumber]])
     watched_data= Data(cookie_auth, 'http://api.myshows.ru/profile/shows/'+showId+'/')
-    try:watched_jdata = json.loads(watched_data.get())
+    try:watched_jdata = watched_data.json()
     except: watched_jdata=None
     ratedict={}
     if watched_jdata:
@@ -183,8 +257,9 @@ def Seasons(showId):
     info={'label':jdata['title'], 'year':jdata['year']}
     meta, banners = None, []
     if syncshows and useTVDB: meta, banners = syncshows.episodes_meta(info)
+    index=PrefixIndex([showId])
     for sNumber in seasons:
-        pre=prefix(showId=int(showId), seasonId=int(sNumber))
+        pre=prefix(showId=int(showId), seasonId=int(sNumber), index=index)
         title=pre+__language__(30138)+' '+str(sNumber)
         stringdata={"showId":int(showId), "seasonId":int(sNumber), "episodeId":None, "id":None}
         sys_url = sys.argv[0] + '?stringdata='+makeapp(stringdata)+'&showId=' + str(showId) + '&seasonNumber=' + str(sNumber) + '&mode=25'
@@ -211,52 +286,53 @@ def Episodes(showId, seasonNumber):
         xbmcplugin.setContent(int(sys.argv[1]), 'tvshows')
         data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+showId)
         watched_data= Data(cookie_auth, 'http://api.myshows.ru/profile/shows/'+showId+'/')
-        jdata = json.loads(data.get())
+        model = data.model()
+        jdata = model.jdata
         try: syncshows=SyncXBMC()
         except: syncshows=False
         saveCheckPoint()
-        try:watched_jdata = json.loads(watched_data.get())
+        try:watched_jdata = watched_data.json()
         except: watched_jdata=[]
         fanart=None
         if syncshows:
             info={'label':jdata['title'], 'year':jdata['year']}
             fanart=syncshows.episode_fanart(info)
 
-        for id in jdata['episodes']:
-            if jdata['episodes'][id]['seasonNumber']==int(seasonNumber):
-                if id in watched_jdata:
-                    playcount=1
-                    if watched_jdata[id]['rating']:
-                        rating=float(watched_jdata[id]['rating'])
-                    else: rating=0
-                else:
-                    playcount=0
-                    rating=0
-                pre=prefix(showId=int(showId),seasonId=jdata['episodes'][id]['seasonNumber'], id=int(id), stype=None, episodeNumber=jdata['episodes'][id]['episodeNumber'])
-                if not pre and syncshows.episode(jdata['title'], jdata['episodes'][id]['seasonNumber'], jdata['episodes'][id]['episodeNumber']): pre='[B][XBMC][/B]'
-                title=pre+jdata['episodes'][id]['title']+' ['+jdata['episodes'][id]['airDate']+']'
-                item = xbmcgui.ListItem('%s. %s' % (str(jdata['episodes'][id]['episodeNumber']), title), iconImage=str(jdata['episodes'][id]['image']), thumbnailImage=str(jdata['episodes'][id]['image']))
-                item.setInfo( type='Video', infoLabels={'Title': title,
-                                                        'year': jdata['year'],
-                                                        'episode': jdata['episodes'][id]['episodeNumber'],
-                                                        'season': jdata['episodes'][id]['seasonNumber'],
-                                                        'tracknumber': jdata['episodes'][id]['sequenceNumber'],
-                                                        'playcount': playcount,
-                                                        'rating': rating*2,
-                                                        'tvshowtitle': jdata['title'],
-                                                        'premiered': jdata['started'],
-                                                        'status': jdata['status'],
-                                                        'code': jdata['imdbId'],
-                                                        'aired': jdata['episodes'][id]['airDate'],
-                                                        'plot': __language__(30266)+' '+str(rating),
-                                                        'votes': jdata['voted']} )
-                stringdata={"showId":int(showId), "episodeId":jdata['episodes'][id]['episodeNumber'], "id":int(id), "seasonId":jdata['episodes'][id]['seasonNumber']}
-                if fanart: item.setProperty('fanart_image', fanart)
-                sys_url = sys.argv[0] + '?stringdata='+makeapp(stringdata)+'&seasonNumber='+seasonNumber+'&showId='+showId+'&episodeId='+str(jdata['episodes'][id]['episodeNumber'])+'&id=' + str(id) + '&playcount=' + str(playcount) + '&mode=30'
-                refresh_url='&refresh_url='+urllib.quote_plus(str(watched_data.url))
-                item.addContextMenuItems(ContextMenuItems(sys_url, refresh_url), True )
-                sys_url=sys_url+refresh_url
-                xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=sys_url, listitem=item, isFolder=False)
+        index=PrefixIndex([showId])
+        for id in model.by_season.get(int(seasonNumber), []):
+            if id in watched_jdata:
+                playcount=1
+                if watched_jdata[id]['rating']:
+                    rating=float(watched_jdata[id]['rating'])
+                else: rating=0
+            else:
+                playcount=0
+                rating=0
+            pre=prefix(showId=int(showId),seasonId=jdata['episodes'][id]['seasonNumber'], id=int(id), stype=None, episodeNumber=jdata['episodes'][id]['episodeNumber'], index=index)
+            if not pre and syncshows and syncshows.episode(jdata['title'], jdata['episodes'][id]['seasonNumber'], jdata['episodes'][id]['episodeNumber']): pre='[B][XBMC][/B]'
+            title=pre+jdata['episodes'][id]['title']+' ['+jdata['episodes'][id]['airDate']+']'
+            item = xbmcgui.ListItem('%s. %s' % (str(jdata['episodes'][id]['episodeNumber']), title), iconImage=str(jdata['episodes'][id]['image']), thumbnailImage=str(jdata['episodes'][id]['image']))
+            item.setInfo( type='Video', infoLabels={'Title': title,
+                                                    'year': jdata['year'],
+                                                    'episode': jdata['episodes'][id]['episodeNumber'],
+                                                    'season': jdata['episodes'][id]['seasonNumber'],
+                                                    'tracknumber': jdata['episodes'][id]['sequenceNumber'],
+                                                    'playcount': playcount,
+                                                    'rating': rating*2,
+                                                    'tvshowtitle': jdata['title'],
+                                                    'premiered': jdata['started'],
+                                                    'status': jdata['status'],
+                                                    'code': jdata['imdbId'],
+                                                    'aired': jdata['episodes'][id]['airDate'],
+                                                    'plot': __language__(30266)+' '+str(rating),
+                                                    'votes': jdata['voted']} )
+            stringdata={"showId":int(showId), "episodeId":jdata['episodes'][id]['episodeNumber'], "id":int(id), "seasonId":jdata['episodes'][id]['seasonNumber']}
+            if fanart: item.setProperty('fanart_image', fanart)
+            sys_url = sys.argv[0] + '?stringdata='+makeapp(stringdata)+'&seasonNumber='+seasonNumber+'&showId='+showId+'&episodeId='+str(jdata['episodes'][id]['episodeNumber'])+'&id=' + str(id) + '&playcount=' + str(playcount) + '&mode=30'
+            refresh_url='&refresh_url='+urllib.quote_plus(str(watched_data.url))
+            item.addContextMenuItems(ContextMenuItems(sys_url, refresh_url), True )
+            sys_url=sys_url+refresh_url
+            xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=sys_url, listitem=item, isFolder=False)
 
 def EpisodeMenu(id, playcount, refresh_url):
     if change_onclick=='true':
@@ -277,8 +353,7 @@ def MyTorrents():
             h=Handler(int(sys.argv[1]), link)
             h.item(link, title=unicode(i['title']))
 
-    data=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').get()
-    jdata = json.loads(data)
+    jdata=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').json()
 
     if sort=='shows':
         showlist=[]
@@ -289,7 +364,7 @@ def MyTorrents():
                 try:
                     if ruName=='true' and jdata[str_showId]['ruTitle']: show_title=jdata[str_showId]['ruTitle']
                     else: show_title=jdata[str_showId]['title']
-                except KeyError: show_title=json.loads(Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).get())['title']
+                except KeyError: show_title=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).json()['title']
                 title=show_title
                 if str_showId not in showlist:
                     showlist.append(str_showId)
@@ -316,7 +391,7 @@ def MyTorrents():
                 try:
                     if ruName=='true' and jdata[str_showId]['ruTitle']: show_title=jdata[str_showId]['ruTitle']
                     else: show_title=jdata[str_showId]['title']
-                except: show_title=json.loads(Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).get())['title']
+                except: show_title=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).json()['title']
                 title=''
                 if prefix(stype=x['stype']): title=prefix(stype=x['stype'])
 
@@ -334,8 +409,7 @@ def MyTorrents():
 
 def MyScanList():
     myscan=ScanDB()
-    data=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').get()
-    jdata = json.loads(data)
+    jdata=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').json()
     listdict=myscan.get_all()
     for x in listdict:
         str_showId=str(x['showId'])
@@ -344,7 +418,7 @@ def MyScanList():
         try:
             if ruName=='true' and jdata[str_showId]['ruTitle']: show_title=jdata[str_showId]['ruTitle']
             else: show_title=jdata[str_showId]['title']
-        except: show_title=json.loads(Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).get())['title']
+        except: show_title=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).json()['title']
         ifstat=myscan.isfilename(str_filename)
         if ifstat: title=TextBB('+', 'b')
         else: title=TextBB('-', 'b')
@@ -381,14 +455,17 @@ def TopShows(action):
         return
 
     tdata=Data(cookie_auth, 'http://api.myshows.ru/shows/top/'+action+'/')
-    get_data= tdata.get().lstrip('[{').rstrip('}]').split('},{')
     syncshows=False
     if useTVDBtop:
         try: syncshows=SyncXBMC()
         except: pass
 
-    for data in get_data:
-        jdata=json.loads('{'+data+'}')
+    pager=Pager({'action': action})
+    rows=[]
+    for i, jdata in enumerate(tdata.stream()):
+        if not pager.visible(i):
+            if pager.more: break
+            continue
         if ruName=='true' and jdata['ruTitle']:
             title=jdata['ruTitle'].encode('utf-8')
         else:
@@ -396,6 +473,16 @@ def TopShows(action):
 
         info={'title': title,'year': jdata['year'],'tvshowtitle': jdata['title'],
               'status': jdata['status'],'votes': jdata['voted'],'rating': float(jdata['rating'])*2}
+        rows.append((jdata, title, info))
+        if len(rows)>=TOP_BATCH:
+            TopShowsRender(pager, syncshows, rows)
+            rows=[]
+    TopShowsRender(pager, syncshows, rows)
+    pager.done()
+
+def TopShowsRender(pager, syncshows, rows):
+    if syncshows: syncshows.prefetch([info for jdata, title, info in rows])
+    for jdata, title, info in rows:
         item = xbmcgui.ListItem(str(jdata['place'])+'. '+title+' ('+str(jdata['year'])+')', iconImage='DefaultFolder.png', thumbnailImage=str(jdata['image']))
         if syncshows: item=syncshows.shows(title, item, info)
         else: item.setInfo( type='Video', infoLabels=info )
@@ -404,33 +491,28 @@ def TopShows(action):
         refresh_url='&refresh_url='+urllib.quote_plus('http://api.myshows.ru/profile/shows/')
         sys_url = sys.argv[0] + '?stringdata='+makeapp(stringdata)+'&showId=' + str(jdata['id']) + '&mode=20'
         item.addContextMenuItems(ContextMenuItems(sys_url, refresh_url), True )
-        xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=sys_url, listitem=item, isFolder=True)
+        pager.add(sys_url, item)
 
 def Recommendations(action):
     try: syncshows=SyncXBMC()
     except: syncshows=False
     xbmcplugin.setContent(int(sys.argv[1]), 'tvshows')
     saveCheckPoint()
+    pager=Pager({'action': action})
     result=[]
     login=__settings__.getSetting("username")
     if action=='xbmcfriends':
         action='friends'
         login='xbmchub'
     if action=='recomm':
-        orig_before=u'                        <p class="description">'
-        orig_after=u'</p>                    </th>'
-        orig_false=u'                                            </th>'
+        orig_before,orig_after,orig_false=ORIG_RECOMM
         subject=Data(cookie_auth, 'http://myshows.ru/profile/recommendations/').get().decode('utf-8')
-        reobj = re.compile(u'<span class="status .+?"><a href=.+?/view/(\d+?)/">(.+?)</a></span>.+?(^'+orig_before+'.+?'+orig_after+'|'+orig_false+').+?<div style="width: (\d+)%"></div>.+?<td>(\d+)%</td>', re.DOTALL | re.MULTILINE)
-        result = reobj.findall(subject)
+        result = RE_RECOMM.findall(subject)
     elif action=='friends':
-        orig_before=u'							<p class="description">'
-        orig_after=u'</p>						</th>'
-        orig_false=u'                            </th>'
+        orig_before,orig_after,orig_false=ORIG_FRIENDS
         subject=Data(cookie_auth, 'http://myshows.ru/'+login+'/friends/rating').get().decode('utf-8')
-        reobj = re.compile(u'<span class="status .+?"><a href=.+?/view/(\d+?)/">(.+?)</a></span>.+?(^'+orig_before+'.+?'+orig_after+'|'+orig_false+').+?<div style="width: (\d+)%"></div>.+?<td width="\d+?%">(\d+)</td>.+?<td width="\d+?%">([0-9.]+)%</td>', re.DOTALL | re.MULTILINE)
-        result = reobj.findall(subject)
-    j=0
+        result = RE_FRIENDS.findall(subject)
+    j,rows=0,[]
     for i in result:
         j+=1
         if action=='recomm':
@@ -445,15 +527,21 @@ def Recommendations(action):
         if ruName!='true': title=origtitle
 
         rating=float(rating)/10
-        item = xbmcgui.ListItem(listtitle, iconImage='DefaultFolder.png',)
         info={'title': title, 'label':title, 'tvshowtitle': origtitle, 'rating': rating, 'year':''}
+        rows.append((showId, title, listtitle, info))
+
+    rows=pager.rows(rows)
+    if syncshows: syncshows.prefetch([row[3] for row in rows])
+    for showId, title, listtitle, info in rows:
+        item = xbmcgui.ListItem(listtitle, iconImage='DefaultFolder.png',)
         if syncshows: item=syncshows.shows(title, item, info)
         else: item.setInfo( type='Video', infoLabels=info )
         stringdata={"showId":int(showId), "seasonId":None, "episodeId":None, "id":None}
         refresh_url='&refresh_url='+urllib.quote_plus('http://api.myshows.ru/profile/shows/')
         sys_url = sys.argv[0] + '?stringdata='+makeapp(stringdata)+'&showId=' + showId + '&mode=20'
         item.addContextMenuItems(ContextMenuItems(sys_url, refresh_url), True )
-        xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=sys_url, listitem=item, isFolder=True)
+        pager.add(sys_url, item)
+    pager.done()
 
 def EpisodeList(action):
     saveCheckPoint()
@@ -463,22 +551,25 @@ def EpisodeList(action):
 
     show_data= Data(cookie_auth, 'http://api.myshows.ru/profile/shows/')
     data= Data(cookie_auth, 'http://api.myshows.ru/profile/episodes/'+action+'/')
-    show_jdata = json.loads(show_data.get())
-    jdata = json.loads(data.get())
+    show_jdata = show_data.json()
+    jdata = data.json()
 
+    index=PrefixIndex()
     for id in jdata:
         str_showId=str(jdata[id]["showId"])
         try:
             show_title=show_jdata[str_showId]['title']
         except KeyError:
-            show_jdata=json.loads(Data(cookie_auth, 'http://api.myshows.ru/profile/shows/', 'http://api.myshows.ru/profile/shows/').get())
+            show_jdata=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/', 'http://api.myshows.ru/profile/shows/').json()
             try:show_title=show_jdata[str_showId]['title']
             except KeyError:
-                show_direct=json.loads(Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).get())
+                show_direct=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).json()
                 show_title=show_direct['title']
+                # json() отдает общий для процесса объект, дополняем копию
+                show_jdata=dict(show_jdata)
                 show_jdata[str_showId]=show_direct
         if ruName=='true' and show_jdata[str_showId]['ruTitle']: show_title=show_jdata[str_showId]['ruTitle']
-        pre=prefix(id=int(id))
+        pre=prefix(id=int(id), index=index)
         left=dates_diff(str(jdata[id]["airDate"]), 'today')
         title=pre+(__language__(30113) % (int_xx(str(jdata[id]['seasonNumber'])), int_xx(str(jdata[id]['episodeNumber'])), left, show_title, jdata[id]['title']))
         item = xbmcgui.ListItem(title, iconImage='DefaultFolder.png', thumbnailImage=show_jdata[ str_showId ]['image'] )
@@ -495,8 +586,8 @@ def EpisodeList(action):
 def ShowList(action):
     show_data= Data(cookie_auth, 'http://api.myshows.ru/profile/shows/')
     data= Data(cookie_auth, 'http://api.myshows.ru/profile/episodes/'+action+'/')
-    show_jdata = json.loads(show_data.get())
-    jdata = json.loads(data.get())
+    show_jdata = show_data.json()
+    jdata = data.json()
 
     num_eps=dict()
     last_date=dict()
@@ -510,11 +601,13 @@ def ShowList(action):
         try:
             show_title=show_jdata[str_showId]['title']
         except KeyError:
-            show_jdata=json.loads(Data(cookie_auth, 'http://api.myshows.ru/profile/shows/', 'http://api.myshows.ru/profile/shows/').get())
+            show_jdata=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/', 'http://api.myshows.ru/profile/shows/').json()
             try:show_title=show_jdata[str_showId]['title']
             except KeyError:
-                show_direct=json.loads(Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).get())
+                show_direct=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str_showId).json()
                 show_title=show_direct['title']
+                # json() отдает общий для процесса объект, дополняем копию
+                show_jdata=dict(show_jdata)
                 show_jdata[str_showId]=show_direct
         if ruName=='true' and show_jdata[str_showId]['ruTitle']: show_title=show_jdata[str_showId]['ruTitle']
         if num_eps.get(str_showId)==None:
@@ -555,12 +648,12 @@ def FriendsNews():
     item = xbmcgui.ListItem(TextBB(i[first][0], 'b'), iconImage='DefaultFolder.png', thumbnailImage='')
     item.setInfo( type='Video', infoLabels={'title': unicode(i[0])} )
     xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=str('%s?action=%s&mode=40' %(sys.argv[0], i[first][1])), listitem=item, isFolder=True)
-    data=Data(cookie_auth, 'http://api.myshows.ru/profile/').get()
-    jfr, avatars=json.loads(data), {}
+    jfr, avatars=Data(cookie_auth, 'http://api.myshows.ru/profile/').json(), {}
     for i in jfr["friends"]:
         avatars[i["login"]]=i["avatar"]+"0"
-    get_data= get_url(cookie_auth, 'http://api.myshows.ru/profile/news/')
-    jx=json.loads(get_data)
+    jx=Data(cookie_auth, 'http://api.myshows.ru/profile/news/').json()
+    pager=Pager({'action': action} if action else {})
+    news=[]
     for u in jx:
         for jdata in jx[u]:
             if jdata['gender']=='m': title_str=__language__(30117)
@@ -569,20 +662,26 @@ def FriendsNews():
                 title=__language__(30119) % (jdata['login'], title_str, str(jdata['episode']), jdata['show'])
             else:
                 title=__language__(30120) % (jdata['login'], title_str, str(jdata['episodes']), jdata['show'])
-            try:item = xbmcgui.ListItem(title, iconImage=avatars[jdata["login"]], thumbnailImage=avatars[jdata["login"]])
-            except:item = xbmcgui.ListItem(title, iconImage='', thumbnailImage='')
-            info={'title': jdata['show'],'label': jdata['show'],'tvshowtitle': jdata['show'],'year':''}
-            if syncshows: item=syncshows.shows(title, item, info, avatar=True)
-            else: item.setInfo( type='Video', infoLabels=info )
-            refresh_url='&refresh_url='+urllib.quote_plus('http://api.myshows.ru/profile/shows/')
-            sys_url = sys.argv[0] + '?showId=' + str(jdata['showId'])+'&mode=20'
-            item.addContextMenuItems(ContextMenuItems(sys_url, refresh_url), True )
-            sys_url=sys.argv[0] + '?action=' + jdata['login'] + '&mode=41'
-            xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=sys_url, listitem=item, isFolder=True)
+            news.append((title, jdata))
+    # у ленты нет ранга, а порядок словаря случаен: листаем по заголовку
+    news=pager.rows(news, key=lambda row: title_key(row[0]))
+    if syncshows:
+        syncshows.prefetch([{'title': jdata['show'],'tvshowtitle': jdata['show'],'year':''} for title, jdata in news])
+    for title, jdata in news:
+        try:item = xbmcgui.ListItem(title, iconImage=avatars[jdata["login"]], thumbnailImage=avatars[jdata["login"]])
+        except:item = xbmcgui.ListItem(title, iconImage='', thumbnailImage='')
+        info={'title': jdata['show'],'label': jdata['show'],'tvshowtitle': jdata['show'],'year':''}
+        if syncshows: item=syncshows.shows(title, item, info, avatar=True)
+        else: item.setInfo( type='Video', infoLabels=info )
+        refresh_url='&refresh_url='+urllib.quote_plus('http://api.myshows.ru/profile/shows/')
+        sys_url = sys.argv[0] + '?showId=' + str(jdata['showId'])+'&mode=20'
+        item.addContextMenuItems(ContextMenuItems(sys_url, refresh_url), True )
+        sys_url=sys.argv[0] + '?action=' + jdata['login'] + '&mode=41'
+        pager.add(sys_url, item)
+    pager.done()
 
 def Profile(action, sort='profile'):
-    data= Data(cookie_auth, 'http://api.myshows.ru/profile/'+action).get()
-    jdata=json.loads(data)
+    jdata=Data(cookie_auth, 'http://api.myshows.ru/profile/'+action).json()
 
     if sort!='profile':
         flist=[]
@@ -607,15 +706,14 @@ def Profile(action, sort='profile'):
             xbmcplugin.setContent(int(sys.argv[1]), 'tvshows')
             try: syncshows=SyncXBMC()
             except: syncshows=False
-            orig_before=u'                <p class="description">'
-            orig_after=u'</p>            </th>'
-            orig_false=u'                            </th>'
+            orig_before,orig_after,orig_false=ORIG_WASTED
             subject=Data(cookie_auth, 'http://myshows.ru/'+action+'/wasted').get().decode('utf-8')
-            reobj = re.compile(r'<span class="status .+?"><a href="http://myshows.ru/view/(\d+)/">(.+?)</a></span>.+?(^'+orig_before+'.+?'+orig_after+'|'+orig_false+').+?.+?<div style="width: (\d+)%"></div>.+?<td>\d+</td>.+?<td>(\d+)</td>.+?<td>(.+?)</td>', re.DOTALL | re.MULTILINE)
-            result = reobj.findall(subject)
+            result = RE_WASTED.findall(subject)
             result=sorted(result, key=lambda x: x[1])
             result=sorted(result, key=lambda x: int(x[3]), reverse=True)
-            for i in result:
+            pager=Pager({'action': action, 'sort': sort})
+            rows=[]
+            for i in pager.rows(result):
                 showId,title,origtitle,rating,totalep,epunwatched=i[0],i[1],i[2],i[3],i[4],i[5]
                 if origtitle==orig_false:
                     origtitle=title.encode('utf-8')
@@ -629,15 +727,20 @@ def Profile(action, sort='profile'):
                 if int(epunwatched)==0: playcount=1
                 else: playcount=0
                 listtitle='[%d] %s' %(int(rating)/2, title)
-                item = xbmcgui.ListItem(listtitle, iconImage='DefaultFolder.png',)
                 info={'title': title, 'label':title, 'tvshowtitle': origtitle, 'rating': rating, 'year':'', 'playcount':playcount, 'episode':int(totalep)}
+                rows.append((showId, title, listtitle, info))
+
+            if syncshows: syncshows.prefetch([row[3] for row in rows])
+            for showId, title, listtitle, info in rows:
+                item = xbmcgui.ListItem(listtitle, iconImage='DefaultFolder.png',)
                 if syncshows: item=syncshows.shows(title, item, info)
                 else: item.setInfo( type='Video', infoLabels=info )
                 stringdata={"showId":int(showId), "seasonId":None, "episodeId":None, "id":None}
                 refresh_url='&refresh_url='+urllib.quote_plus('http://api.myshows.ru/profile/shows/')
                 sys_url = sys.argv[0] + '?stringdata='+makeapp(stringdata)+'&showId=' + showId + '&mode=20'
                 item.addContextMenuItems(ContextMenuItems(sys_url, refresh_url), True )
-                xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url=sys_url, listitem=item, isFolder=True)
+                pager.add(sys_url, item)
+            pager.done()
     else:
 
         if action==login:
@@ -752,9 +855,8 @@ def Rate(showId, id, refresh_url, selftitle=None):
             WatchedDB().check(selftitle,int(rate[ret]))
             return False
         if getSettingAsBool('ratekinopoisk') and id=='0' and ok:
-                jload=Data(cookie_auth, 'http://api.myshows.ru/shows/'+showId).get()
-                if jload:
-                    jdata = json.loads(jload)
+                jdata=Data(cookie_auth, 'http://api.myshows.ru/shows/'+showId).json()
+                if jdata:
                     title=jdata['title'].encode('utf-8')
                     try: titleAlt=jdata['ruTitle'].encode('utf-8')
                     except:titleAlt=None
@@ -856,6 +958,14 @@ def ContextMenuItems(sys_url, refresh_url, ifstat=None):
     for s in menu: myshows_dict.append([s.split('|:|')[0],'XBMC.RunPlugin('+s.split('|:|')[1]+')'])
     return myshows_dict
 
+def tvdb_query(info):
+    title, tvshowtitle = info['title'], info['tvshowtitle']
+    try:title=title.decode('utf-8','ignore')
+    except:pass
+    try:tvshowtitle=tvshowtitle.decode('utf-8','ignore')
+    except:pass
+    return {'label':title, 'search':[tvshowtitle,title], 'year':info['year']}
+
 class SyncXBMC():
     def __init__(self, inner=None, rating=None):
         self.menu,self.rating,self.title=None,None,title
@@ -865,10 +975,8 @@ class SyncXBMC():
             self.action='check'
             self.title=str(inner)
             self.rating=rating
-        self.jloadshows=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').get()
-        if self.jloadshows:
-            self.jdatashows = json.loads(self.jloadshows)
-        else: return
+        self.jdatashows=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').json()
+        if not self.jdatashows: return
         if self.action in ['check']:
             self.match=json.loads(self.title)
         if self.useTVDB:
@@ -1001,17 +1109,17 @@ class SyncXBMC():
             return showId
 
     def getid(self, showId, seasonNumber, episodeId, lable=None):
-        data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).get()
-        jdata = json.loads(data)
+        model=show_model(showId)
+        jdata=model.jdata
         if seasonNumber and int(seasonNumber)>0 and episodeId:
-            for id in jdata['episodes']:
-                if jdata['episodes'][id]['seasonNumber']==int(seasonNumber) and jdata['episodes'][id]['episodeNumber']==int(episodeId):
-                    return int(id)
+            id=model.by_se.get((int(seasonNumber), int(episodeId)))
+            if id:
+                return int(id)
+        if lable and lable in model.by_title:
+            return int(model.by_title[lable])
         episodes=[]
         for id in jdata['episodes']:
             episodes.append((id, jdata['episodes'][id]['title'], jdata['episodes'][id]['seasonNumber']))
-            if lable and jdata['episodes'][id]['title']==lable:
-                return int(id)
         if len(episodes)==1:
             return int(episodes)
         episodes=sorted(episodes, key=lambda x: x[0], reverse=True)
@@ -1038,6 +1146,40 @@ class SyncXBMC():
             item=self.shows(i['title'],item)
             xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url='', listitem=item, isFolder=True)
 
+    def prefetch(self, infos):
+        """
+        Looks up every show of a listing in TheTVDB with a few threads up
+        front, so the shows() calls that follow are answered from tvdb.db.
+        """
+        if not self.useTVDB or not infos:
+            return
+        import Queue
+        from search.scrapers import Scrapers
+        queue, seen = Queue.Queue(), set()
+        for info in infos:
+            query=tvdb_query(info)
+            key=(tuple(query['search']), query['year'])
+            if key not in seen:
+                seen.add(key)
+                queue.put(query)
+
+        def worker():
+            scrapers=Scrapers()
+            while not deadline.expired():
+                try: query=queue.get_nowait()
+                except Queue.Empty: return
+                try: scrapers.scraper('tvdb', query)
+                except Exception, e: Debug('[prefetch] '+str(e))
+
+        started=time.time()
+        threads=[threading.Thread(target=worker) for i in range(min(PREFETCH_THREADS, len(seen)))]
+        for t in threads:
+            t.daemon=True
+            t.start()
+        for t in threads:
+            t.join()
+        Debug('[prefetch] %d shows in %.2fs' % (len(seen), time.time()-started))
+
     def shows(self, title, item, info=None, avatar=False):
         if not self.menu and not self.useTVDB:
             return item
@@ -1049,7 +1191,7 @@ class SyncXBMC():
             except:pass
             try:info['tvshowtitle']=info['tvshowtitle'].decode('utf-8','ignore')
             except:pass
-            meta=self.TVDB.scraper('tvdb', {'label':info['title'], 'search':[info['tvshowtitle'],info['title']], 'year':info['year']})
+            meta=self.TVDB.scraper('tvdb', tvdb_query(info))
 
             if not meta:
                 return item
@@ -1079,28 +1221,20 @@ class SyncXBMC():
             return item
 
         self.menu=self.get_menu()
-        for i in range(len(self.menu)):
+        show=library.find(title)
+        if show:
+            # копия: снимок библиотеки общий для всего списка
+            show=dict(show)
             try:
-                if title in self.menu[i]['title']:
-                    item.setProperty('fanart_image', self.menu[i]['fanart'])
-
-                    for studio_info in self.menu[i]['studio']:
-                        try: studio+=', '+studio_info
-                        except: studio=studio_info
-                    self.menu[i]['studio']=studio.encode('utf-8')
-
-                    for genre_info in self.menu[i]['genre']:
-                        try: genre+=', '+genre_info
-                        except: genre=genre_info
-                    self.menu[i]['genre']=genre.encode('utf-8')
-
-                    if info:
-                        self.menu[i]['title']=info['title']
-                        self.menu[i]['playcount']=0
-                        self.menu[i]['plot']=info['plot']+self.menu[i]['plot']
-                        break
+                item.setProperty('fanart_image', show['fanart'])
+                show['studio']=', '.join(show['studio']).encode('utf-8')
+                show['genre']=', '.join(show['genre']).encode('utf-8')
+                if info:
+                    show['title']=info['title']
+                    show['playcount']=0
+                    show['plot']=info['plot']+show['plot']
             except:pass
-        try: item.setInfo( type='Video', infoLabels=self.menu[i] )
+        try: item.setInfo( type='Video', infoLabels=show )
         except: item.setInfo( type='Video', infoLabels=info)
 
         return item
@@ -1131,25 +1265,14 @@ class SyncXBMC():
             item.setInfo(type='Video', infoLabels=meta['info'] )
             return item
 
-        self.menu=self.get_menu()
-        for i in range(len(self.menu)):
-            if title in self.menu[i]['title']:
-                #Debug('episodes:'+title+' '+str(self.menu[i]['title']))
-                item.setProperty('fanart_image', self.menu[i]['fanart'])
-                break
+        show=library.find(title)
+        if show:
+            item.setProperty('fanart_image', show['fanart'])
         item.setInfo( type='Video', infoLabels=info )
         return item
 
     def episode(self, title, seasonId, episodeNumber):
-        self.menu=self.get_menu()
-        if not self.menu:
-            return False
-        for i in range(len(self.menu)):
-            if title in self.menu[i]['title']:
-                for episode in self.menu[i]['episodes']:
-                    if episode['episode']==episodeNumber and episode['season']==seasonId:
-                        return True
-        return False
+        return library.has(title, seasonId, episodeNumber)
 
     def episode_fanart(self, info):
         if self.useTVDB:
@@ -1160,45 +1283,14 @@ class SyncXBMC():
             else:
                 return meta['properties']['fanart_image']
 
-        self.menu=self.get_menu()
-        if not self.menu:
+        show=library.find(info.get('title') or info['label'])
+        if not show:
             return ''
-        for i in range(len(self.menu)):
-            try:
-                if info['title'] in self.menu[i]['title']:
-                    return self.menu[i]['fanart']
-            except:pass
-        return ''
+        return show['fanart']
 
     def GetFromXBMC(self):
-        from utilities import xbmcJsonRequest
-        Debug('[Episodes Sync] Getting episodes from XBMC')
-
-        shows = xbmcJsonRequest({'jsonrpc': '2.0', 'method': 'VideoLibrary.GetTVShows', 'params': {'properties': ['title', 'originaltitle', 'genre', 'year', 'rating', 'plot', 'studio', 'mpaa', 'cast', 'imdbnumber', 'premiered', 'votes', 'fanart', 'thumbnail', 'episodeguide', 'playcount', 'season', 'episode', 'tag']}, 'id': 0})
-
-        # sanity check, test for empty result
-        if not shows:
-            Debug('[Episodes Sync] xbmc json request was empty.')
-            return
-
-        # test to see if tvshows key exists in xbmc json request
-        if 'tvshows' in shows:
-            shows = shows['tvshows']
-            #Debug("[Episodes Sync] XBMC JSON Result: '%s'" % str(shows))
-        else:
-            Debug("[Episodes Sync] Key 'tvshows' not found")
-            return
-
-        for show in shows:
-            show['episodes'] = []
-
-            episodes = xbmcJsonRequest({'jsonrpc': '2.0', 'method': 'VideoLibrary.GetEpisodes', 'params': {'tvshowid': show['tvshowid'], 'properties': ['season', 'episode', 'playcount', 'uniqueid', 'file']}, 'id': 0})
-            if 'episodes' in episodes:
-                episodes = episodes['episodes']
-
-                show['episodes'] = [x for x in episodes if type(x) == type(dict())]
-
-        self.xbmc_shows = [x for x in shows if x['episodes']]
+        shows=library.shows()
+        self.xbmc_shows=[x for x in shows if x['episodes']]
         return shows
 
     def itemTVDB(self, item, kwarg, avatar=False):
@@ -1223,38 +1315,16 @@ class SyncXBMC():
 
 class WatchedDB:
     def __init__(self):
-        dirname = xbmc.translatePath('special://temp')
-        for subdir in ('xbmcup', sys.argv[0].replace('plugin://', '').replace('/', '')):
-            dirname = os.path.join(dirname, subdir)
-            if not xbmcvfs.exists(dirname):
-                xbmcvfs.mkdir(dirname)
-        self.dbfilename = os.path.join(dirname, 'data.db3')
-        if not xbmcvfs.exists(self.dbfilename):
-            creat_db(self.dbfilename)
         self.dialog = xbmcgui.Dialog()
 
     def _get(self, id):
-        self._connect()
         Debug('[WatchedDB][_get]: Checking '+id)
         id=id.replace("'","<&amp>").decode('utf-8','ignore')
-        self.where=" where id='%s'" % (id)
-        #if 1==1:
-        try:
-            self.cur.execute('select rating from watched'+self.where)
-        except:
-        #else:
-            self.cur.execute('create table watched(addtime integer, rating integer, id varchar(32) PRIMARY KEY)')
-            self.cur.execute('select rating from watched'+self.where)
-        res=self.cur.fetchone()
-        self._close()
+        res=store().fetchone('select rating from watched where id=?', (id,))
         return res[0] if res else None
 
     def _get_all(self):
-        self._connect()
-        self.cur.execute('select id, rating from watched order by addtime desc')
-        res = [[unicode(x[0]).replace("<&amp>","'").encode('utf-8','ignore'),x[1]] for x in self.cur.fetchall()]
-        self._close()
-        return res
+        return [[unicode(x[0]).replace("<&amp>","'").encode('utf-8','ignore'),x[1]] for x in store().fetchall('select id, rating from watched order by addtime desc')]
 
     def check(self, id, rating=0):
         ok1,ok3=None,None
@@ -1291,11 +1361,7 @@ class WatchedDB:
 
     def onaccess(self):
         #Debug('[WatchedDB][onaccess]: Start')
-        self._connect()
-        self.cur.execute('select count(id) from watched')
-        x=self.cur.fetchone()
-        res=int(x[0])
-        self._close()
+        res=int(store().fetchone('select count(id) from watched')[0])
         i=0
 
         if res>0:
@@ -1317,27 +1383,61 @@ class WatchedDB:
         return res
 
     def _add(self, id, rating=0):
-        self._connect()
         id=id.replace("'","<&amp>").decode('utf-8','ignore')
         Debug('[WatchedDB][_add]: Adding %s with rate %d' % (id, rating))
-        self.cur.execute('insert into watched(addtime, rating, id) values(?,?,?)', (int(time.time()), int(rating), id))
-        self.db.commit()
-        self._close()
+        store().execute('insert into watched(addtime, rating, id) values(?,?,?)', (int(time.time()), int(rating), id))
 
     def _delete(self, id):
-        self._connect()
         id=id.replace("'","<&amp>").decode('utf-8','ignore')
-        self.cur.execute("delete from watched where id=('"+id+"')")
-        self.db.commit()
-        self._close()
-
-    def _connect(self):
-        self.db = sqlite.connect(self.dbfilename)
-        self.cur = self.db.cursor()
-
-    def _close(self):
-        self.cur.close()
-        self.db.close()
+        store().execute('delete from watched where id=?', (id,))
+
+def warm_data(url):
+    data=Data(cookie_auth, url)
+    if data.refresh or data.stale:
+        data.write()
+        bump('warm_refreshed')
+        xbmc.sleep(WARM_DELAY*1000)
+    try: return data.json()
+    except: return None
+
+def Warm():
+    import heapq
+    deadline.start(WARM_BUDGET)
+    jdata=warm_data('http://api.myshows.ru/profile/shows/')
+    if not jdata: return
+    # сначала недавно открытые сериалы, потом остальные смотрящиеся
+    recent=dict(store().fetchall('select showId, addtime from recent'))
+    queue=[]
+    for showId in set([int(x) for x in jdata]+recent.keys()):
+        if showId in recent or jdata[str(showId)]['watchStatus']=='watching':
+            heapq.heappush(queue, (-recent.get(showId, 0), showId))
+    scrapers=None
+    if useTVDB:
+        from search.scrapers import Scrapers
+        scrapers=Scrapers()
+    done=0
+    while queue and done<WARM_SHOWS and not deadline.expired() and not xbmc.abortRequested:
+        if xbmc.getGlobalIdleTime()<WARM_IDLE:
+            Debug('[Warm] User is back, stopping')
+            break
+        showId=str(heapq.heappop(queue)[1])
+        show=warm_data('http://api.myshows.ru/shows/'+showId)
+        if showId in jdata: warm_data('http://api.myshows.ru/profile/shows/'+showId+'/')
+        if scrapers and show:
+            query={'label':show['title'], 'search':show['title'], 'year':str(show['year'])}
+            try:
+                scrapers.scraper('tvdb', query)
+                query['season']=True
+                scrapers.scraper('tvdb', query)
+            except Exception, e: Debug('[Warm] '+str(e))
+        done+=1
+    Debug('[Warm] %d shows warmed' % done)
+
+def Stats():
+    flush()
+    for name, value in sorted(counters().items()):
+        item = xbmcgui.ListItem('%s: %s' % (name, str(value)), iconImage='DefaultFolder.png', thumbnailImage='')
+        xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]), url='', listitem=item, isFolder=False)
 
 def Test():
     #SyncXBMC()
@@ -1409,6 +1509,7 @@ sort            = None
 episodeId       = None
 refresh_url     = None
 stringdata      = None
+page            = 0
 
 
 try:    title = urllib.unquote_plus(params['title'])
@@ -1458,6 +1559,11 @@ try:    refresh_url = urllib.unquote_plus(apps['argv']['refresh_url'])
 except: pass
 try:    stringdata = urllib.unquote_plus(apps['argv']['stringdata'])
 except: pass
+try:    page = int(apps['argv']['page'])
+except: pass
+
+if mode in LISTING_MODES:
+    deadline.start(LISTING_DEADLINE)
 
 if mode == None:
     Main()
@@ -1590,7 +1696,16 @@ elif mode == 304 or mode==204 or mode==254:
     PlaySource()
 elif mode in (205,255):
     ontop('update', stringdata)
+elif mode == 80:
+    Warm()
+elif mode == 81:
+    library.refresh()
+elif mode == 998:
+    Stats()
 elif mode == 999:
     Test()
 
+Debug('[Store] connects: %d' % Store.connects)
+flush()
+if debug=='true': Debug('[Store] counters: %s' % str(counters()))
 xbmcplugin.endOfDirectory(int(sys.argv[1]))
\ No newline at end of file
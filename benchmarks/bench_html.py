@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+Clear.text throughput in MB/s (utf-8 input) on two synthetic pages:
+
+    dense  - random tags, entities, spaces and newlines, every piece a token
+    page   - a myshows-like description block repeated, long text runs
+
+for three implementations:
+
+    old       - the regex chain before the cleanup, every pass always runs
+    tokenizer - one scan with a single alternation regex, the rejected design
+    current   - search/html.py
+
+The three are first compared on fuzzed inputs.
+
+    python benchmarks/bench_html.py [fuzz inputs]
+"""
+
+import re, random, htmlentitydefs
+
+import stubs
+stubs.install()
+
+from search import html
+
+
+class OldClear:
+    """search/html.py Clear before the cleanup."""
+    UNSUPPORT = {'&#151;': '-'}
+    ENTITY = re.compile('&#?\w+;', re.U)
+
+    def text(self, text, inner=False):
+        text = self._unsupport(text).replace(u'\r', u'\n')
+        text = html.RE['br'].sub(u'\n', text)
+        if inner:
+            text = html.RE['inner'].sub(u'', text)
+        text = html.RE['html'].sub(u'', text)
+        text = self.char(text)
+        text = html.RE['space'].sub(u' ', text)
+        return html.RE['cl'].sub(u'\n', text).strip()
+
+    def char(self, text):
+        return self.ENTITY.sub(self._unescape, self._unsupport(text))
+
+    def _unsupport(self, text):
+        for tag, value in self.UNSUPPORT.iteritems():
+            text = text.replace(tag, value)
+        return text
+
+    def _unescape(self, m):
+        text = m.group(0)
+        if text[:2] == u"&#":
+            try:
+                if text[:3] == u"&#x":
+                    return unichr(int(text[3:-1], 16))
+                else:
+                    return unichr(int(text[2:-1]))
+            except ValueError:
+                pass
+        else:
+            try:
+                text = unichr(htmlentitydefs.name2codepoint[text[1:-1]])
+            except KeyError:
+                pass
+        return text
+
+
+TOKEN = re.compile(r'(<\s*br[\s/]*>)|<[^>]*>|(&#?\w+;)|([\r\n])|([ ]+)', re.U)
+
+class TokenClear:
+    """One pass over the tokens, collapsing spaces and newlines as it emits
+    (no inner mode, a decoded entity is never collapsed)."""
+    _unescape = html.Clear()._unescape
+
+    def text(self, text):
+        out = []
+        last = u''
+        pos = 0
+        for m in TOKEN.finditer(text):
+            start = m.start()
+            if start > pos:
+                out.append(text[pos:start])
+                last = u'x'
+            br, entity, newline, space = m.groups()
+            if br or newline:
+                if last != u'\n':
+                    out.append(u'\n')
+                    last = u'\n'
+            elif space:
+                if last != u' ':
+                    out.append(u' ')
+                    last = u' '
+            elif entity:
+                try:
+                    out.append(html.ENTITY[entity])
+                except KeyError:
+                    out.append(self._unescape(entity))
+                last = u'x'
+            pos = m.end()
+        out.append(text[pos:])
+        return u''.join(out).strip()
+
+
+PIECES = [u'<p>', u'</p>', u'<br>', u'<br />', u'  ', u' ', u'\n', u'\r\n', u'\n\n', u'&amp;', u'&#151;',
+          u'&nbsp;', u'&#x41;', u'&bogus;', u'слово', u'word', u'<b>x</b>', u'\t']
+
+PARAGRAPH = (u'<div class="row">\n    <p class="description">Описание сериала &laquo;Сериал&raquo; &mdash; '
+             u'долгая история про людей, которые живут в городе, и у них всё хорошо.<br/>\n'
+             u' Вторая строка текста, тоже довольно длинная.</p>\n    <td width="10%">12</td>\n</div>\n')
+
+
+def main():
+    inputs = int(stubs.args[0]) if stubs.args else 20000
+    variants = (('old', OldClear()), ('tokenizer', TokenClear()), ('current', html.Clear()))
+
+    random.seed(1)
+    mismatch = dict((name, 0) for name, clear in variants)
+    for n in range(inputs):
+        text = u''.join(random.choice(PIECES) for i in range(random.randint(0, 15)))
+        expect = OldClear().text(text)
+        for name, clear in variants:
+            mismatch[name] += clear.text(text) != expect
+    print 'fuzz, %d inputs: %s' % (inputs, ', '.join('%s %d mismatches' % (name, mismatch[name]) for name, clear in variants[1:]))
+
+    pages = (('dense', u''.join(random.choice(PIECES) for i in range(200000))),
+             ('page', PARAGRAPH * 5000))
+    for title, page in pages:
+        size = len(page.encode('utf-8'))
+        print '%s, %.1f MB:' % (title, size / 1e6)
+        for name, clear in variants:
+            took = stubs.timeit(lambda: clear.text(page), 3)
+            print '    %-10s %5.1f MB/s' % (name, size / took / 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+The [XBMC] marker of an Episodes render on a synthetic library of
+shows x episodes (500 x 100 = 50k by default), for a show that is in the
+library and one that is not:
+
+    scan   - SyncXBMC.episode before library.py, a walk over every show
+             and its episodes per row
+    path   - library.path as added by the snapshot, title lookup with a
+             substring scan on a miss, per row
+    has    - library.has, the (title, season, episode) set
+
+    python benchmarks/bench_library.py [shows] [episodes per show]
+"""
+
+import stubs
+stubs.install()
+
+import library
+
+
+def scan(menu, title, season, episode):
+    for i in range(len(menu)):
+        if title in menu[i]['title']:
+            for e in menu[i]['episodes']:
+                if e['episode'] == episode and e['season'] == season:
+                    return True
+    return False
+
+
+def path(title, season, episode):
+    key = library._key(title)
+    show = library._titles.get(key)
+    if show is None:
+        show = next((x for x in library._shows if key in library._key(x['title'])), None)
+    if show is None:
+        return None
+    return library._files.get((show['tvshowid'], int(season), int(episode)))
+
+
+def main():
+    shows = int(stubs.args[0]) if len(stubs.args) > 0 else 500
+    episodes = int(stubs.args[1]) if len(stubs.args) > 1 else 100
+    seasons = 5
+    snapshot = [{'tvshowid': i, 'title': u'Show %d' % i, 'fanart': '',
+                 'episodes': [{'season': s, 'episode': e, 'file': 'show%d/s%de%d.mkv' % (i, s, e)}
+                              for s in range(1, seasons + 1) for e in range(1, episodes / seasons + 1)]}
+                for i in range(shows)]
+
+    took = stubs.timeit(lambda: library._index(snapshot))
+    print 'index of %d episodes: %.1f ms, once per process' % (shows * episodes, took * 1000)
+
+    season = range(1, episodes / seasons + 1)
+    for title in (u'Show %d' % (shows - 1), u'Not in library'):
+        print '%s, a %d-episode season:' % (title, len(season))
+        for name, lookup in (('scan', lambda e: scan(snapshot, title, seasons, e)),
+                             ('path', lambda e: path(title, seasons, e)),
+                             ('has', lambda e: library.has(title, seasons, e))):
+            # each run is a new listing: the title memo of has() starts empty
+            took = stubs.timeit(lambda: library._found.clear() or [lookup(e) for e in season], 5)
+            print '    %-5s %8.3f ms' % (name, took * 1000)
+
+
+if __name__ == '__main__':
+    main()
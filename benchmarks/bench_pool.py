@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sequential HTTP.fetch GETs against a local HTTP/1.1 keep-alive stub
+server, with a new connection per request (urllib2's HTTPHandler, as
+before the pool) and through the shared ConnectionPool/KeepAliveHandler.
+
+    python benchmarks/bench_pool.py [requests]
+"""
+
+import threading, urllib2, BaseHTTPServer, SocketServer
+
+import stubs
+stubs.install()
+
+import net
+
+BODY = '{"id": 1, "title": "Show"}' * 40
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # one send per response, as a real server does; unbuffered header
+    # lines hit Nagle and the delayed ACK on a kept-alive connection
+    wbufsize = -1
+    connections = 0
+
+    def setup(self):
+        Handler.connections += 1
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def run(url, requests):
+    for i in range(requests):
+        response = net.HTTP().fetch(url)
+        assert response.code == 200 and response.body == BODY, response.error
+
+
+def main():
+    requests = int(stubs.args[0]) if stubs.args else 300
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%d/shows/1' % server.server_address[1]
+
+    pooled = net.KeepAliveHandler
+    for name, handler in (('new connection', lambda connect_timeout=None: urllib2.HTTPHandler()),
+                          ('pooled', pooled)):
+        net.KeepAliveHandler = handler
+        Handler.connections = 0
+        took = stubs.timeit(lambda: run(url, requests))
+        print '%-15s %6.0f req/s, %d connections for %d requests' % (name, requests / took, Handler.connections, requests)
+    net.KeepAliveHandler = pooled
+    for conns in net._pool.idle.values():
+        for con in conns:
+            con.close()
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
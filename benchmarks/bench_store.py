@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+sqlite connects per listing render: the per-call connections of the old
+CacheDB/TorrentDB against the shared Store connection (store.py).
+
+The listing follows the db traffic of an Episodes render: two Data
+objects that each read their cache row twice, then one sources lookup
+for the prefix of every episode row.
+
+    python benchmarks/bench_store.py [episodes] [renders]
+"""
+
+import time
+
+import stubs
+stubs.install()
+
+import store as storemodule
+from store import Store, store
+
+try:
+    from sqlite3 import dbapi2 as sqlite
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite
+
+connects = [0]
+_connect = sqlite.connect
+
+def counted_connect(*args, **kwargs):
+    connects[0] += 1
+    return _connect(*args, **kwargs)
+
+
+class BaselineDB:
+    """CacheDB.get and TorrentDB.get as they were: a connection per call."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def cache_get(self, url):
+        db = counted_connect(self.filename)
+        cur = db.cursor()
+        cur.execute('select addtime from cache where url="' + url + '"')
+        x = cur.fetchone()
+        cur.close()
+        db.close()
+        return x[0] if x else None
+
+    def source_get(self, showId, seasonId, id):
+        db = counted_connect(self.filename)
+        cur = db.cursor()
+        cur.execute('select filename, stype, showId, seasonId, id, episodeId from sources where showId=' + str(showId) +
+                    ' and id=' + str(id) + ' and seasonId=' + str(seasonId))
+        x = cur.fetchone()
+        cur.close()
+        db.close()
+        return x
+
+
+class StoreDB:
+    """The same queries through the shared Store."""
+
+    def cache_get(self, url):
+        x = store().fetchone('select addtime from cache where url=?', (url,))
+        return x[0] if x else None
+
+    def source_get(self, showId, seasonId, id):
+        return store().fetchone('select filename, stype, showId, seasonId, id, episodeId from sources where showId=? and id=? and seasonId=?',
+                                (showId, id, seasonId))
+
+
+def render(db, episodes):
+    for url in ('http://api.myshows.ru/shows/1', 'http://api.myshows.ru/profile/shows/1/'):
+        # Data.__init__ read the cache row twice for its freshness check
+        db.cache_get(url)
+        db.cache_get(url)
+    for id in range(episodes):
+        db.source_get(1, 1, 1000 + id)
+
+
+def main():
+    episodes = int(stubs.args[0]) if len(stubs.args) > 0 else 25
+    renders = int(stubs.args[1]) if len(stubs.args) > 1 else 20
+
+    filename = store().filename
+    for id in range(0, episodes, 3):
+        store().execute('insert into sources(addtime, filename, stype, showId, seasonId, id, episodeId) values(?,?,?,?,?,?,?)',
+                        (int(time.time()), 'file%d' % id, 'torrent', 1, 1, 1000 + id, id))
+    store().execute('insert into cache(addtime, url) values(?,?)', (int(time.time()), 'http://api.myshows.ru/shows/1'))
+
+    baseline = BaselineDB(filename)
+    connects[0] = 0
+    took = stubs.timeit(lambda: render(baseline, episodes), renders)
+    print 'baseline CacheDB/TorrentDB: %3d connects per render, %.2f ms per render' % (connects[0] / renders, took * 1000)
+
+    # as in a fresh process: the Store is opened once, every render after that reuses it
+    storemodule._store = None
+    Store.connects = 0
+    took = stubs.timeit(lambda: render(StoreDB(), episodes), renders)
+    print 'shared Store:               %3d connects in %d renders, %.2f ms per render' % (Store.connects, renders, took * 1000)
+
+
+if __name__ == '__main__':
+    main()
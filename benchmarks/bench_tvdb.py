@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+TvDb._movie on a synthetic ru.xml bundle (3000 episodes by default, about
+6MB): the iterparse pass against the regex scans it replaced.
+
+    python benchmarks/bench_tvdb.py [episodes]
+"""
+
+import os, re, zipfile
+
+import stubs
+stubs.install()
+
+from search.tvdb import TvDb
+
+SERIES_ID = '70001'
+
+OVERVIEW = (u'Длинное описание серии, в котором герои снова попадают в переделку, '
+            u'а зритель узнает немного больше о прошлом каждого из них. ') * 6
+
+
+def fixture(episodes):
+    """ru.xml of one series with the given number of episodes."""
+    parts = [u'<?xml version="1.0" encoding="UTF-8" ?>\n<Data>\n<Series>\n'
+             u'<id>%s</id><Actors>|Актер Один|Актер Два|Actor Three|</Actors>'
+             u'<ContentRating>TV-14</ContentRating><FirstAired>2005-03-26</FirstAired>'
+             u'<Genre>|Drama|Science-Fiction|</Genre><Network>BBC One</Network>'
+             u'<Overview>%s</Overview><Rating>8.9</Rating><RatingCount>512</RatingCount>'
+             u'<Runtime>50</Runtime><SeriesName>Доктор Кто</SeriesName>'
+             u'<fanart>fanart/original/%s-1.jpg</fanart><poster>posters/%s-1.jpg</poster>\n'
+             u'</Series>\n' % (SERIES_ID, OVERVIEW, SERIES_ID, SERIES_ID)]
+    for n in range(episodes):
+        season, number = n / 13 + 1, n % 13 + 1
+        parts.append(u'<Episode>\n<id>%d</id><Combined_episodenumber>%d</Combined_episodenumber>'
+                     u'<Director>|Режиссер %d|</Director><EpisodeName>Серия %d</EpisodeName>'
+                     u'<EpisodeNumber>%d</EpisodeNumber><FirstAired>2005-04-02</FirstAired>'
+                     u'<GuestStars>|Гость %d|Guest %d|</GuestStars><Language>ru</Language>'
+                     u'<Overview>%s</Overview><SeasonNumber>%d</SeasonNumber>'
+                     u'<Writer>|Сценарист %d|Writer %d|</Writer><filename>episodes/%s/%d.jpg</filename>\n'
+                     u'</Episode>\n' % (100000 + n, number, n % 40, n, number, n, n, OVERVIEW, season,
+                                        n % 25, n % 30, SERIES_ID, 100000 + n))
+    parts.append(u'</Data>\n')
+    return u''.join(parts).encode('utf-8')
+
+
+def regex_movie(tvdb, id):
+    """_movie before the iterparse pass, trimmed to the parsing it timed."""
+    movie = tvdb._bundle_read(id, 'ru.xml').decode('utf8')
+    body = re.compile(r'<Series>(.+?)</Series>', re.U|re.S).search(movie).group(1)
+    info = {}
+    for tag in ('Director', 'Writer'):
+        people = {}
+        people_list = []
+        [people_list.extend(x.split('|')) for x in re.compile(r'<' + tag + r'>([^<]+)</' + tag + r'>', re.U|re.S).findall(movie)]
+        [people.update({x: 1}) for x in [x.strip() for x in people_list] if x]
+        if people:
+            info[tag.lower()] = u', '.join([x for x in people.keys() if x])
+    for tag, retag in (('plot', 'Overview'), ('mpaa', 'ContentRating'), ('premiered', 'FirstAired'),
+                       ('studio', 'Network'), ('title', 'SeriesName'), ('runtime', 'Runtime'),
+                       ('votes', 'RatingCount'), ('rating', 'Rating'), ('genre', 'Genre'), ('cast', 'Actors'),
+                       ('poster', 'poster'), ('fanart', 'fanart')):
+        r = re.compile(r'<' + retag + r'>([^<]+)</' + retag + r'>', re.U|re.S).search(body)
+        if r:
+            info[tag] = r.group(1).strip()
+    return info
+
+
+def main():
+    episodes = int(stubs.args[0]) if stubs.args else 3000
+    tvdb = TvDb()
+    data = fixture(episodes)
+    # a fresh bundle next to tvdb.db is used as is, without a download
+    filename = os.path.join(os.path.dirname(tvdb.cache.filename), 'tvdb_' + SERIES_ID + '.zip')
+    filezip = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+    filezip.writestr('ru.xml', data)
+    filezip.close()
+    print 'ru.xml: %d episodes, %.1f MB' % (episodes, len(data) / 1e6)
+
+    timeout, res = tvdb._movie(SERIES_ID)
+    old = regex_movie(tvdb, SERIES_ID)
+    for tag in ('director', 'writer'):
+        assert sorted(res['info'][tag].split(u', ')) == sorted(old[tag].split(u', ')), tag
+    assert res['info']['title'] == old['title'] and res['info']['rating'] == float(old['rating'])
+
+    took = stubs.timeit(lambda: regex_movie(tvdb, SERIES_ID), 5)
+    print 'regex scans: %.3f s, whole decoded document in memory (%.1f MB as unicode)' % (took, len(data.decode('utf-8')) * 2 / 1e6)
+    took = stubs.timeit(lambda: tvdb._movie(SERIES_ID), 5)
+    print 'iterparse:   %.3f s, one episode element in memory at a time' % took
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Stand-ins for the XBMC modules, so the plugin modules import outside XBMC.
+
+    install - registers xbmc, xbmcaddon, xbmcgui, xbmcplugin, xbmcvfs and
+              utilities in sys.modules, points special://temp at a fresh
+              temporary dir and puts the plugin dir on sys.path
+    args    - the benchmark's own command line, sys.argv becomes the
+              plugin's (base url, handle, query)
+    timeit  - best wall time of a few runs
+
+Every benchmark imports this first:
+
+    import stubs; stubs.install()
+"""
+
+import os, sys, types, tempfile, shutil, atexit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN = 'plugin.video.myshows'
+
+temp = None
+args = []
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+class Addon(object):
+    settings = {'refresh_period': '0', 'page_size': '0'}
+
+    def __init__(self, id=None):
+        pass
+
+    def getSetting(self, key):
+        return self.settings.get(key, '')
+
+    def setSetting(self, key, value):
+        self.settings[key] = value
+
+    def getAddonInfo(self, key):
+        return ROOT
+
+    def getLocalizedString(self, id):
+        return u'%d' % id
+
+class File(object):
+    def __init__(self, path, mode='r'):
+        self.path = path
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+class ListItem(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+def _mkdir(path):
+    os.makedirs(path)
+    return True
+
+def install():
+    global temp, args
+    if temp:
+        return temp
+    args = sys.argv[1:]
+    temp = tempfile.mkdtemp(prefix='myshows-bench-')
+    atexit.register(shutil.rmtree, temp, True)
+    sys.argv = ['plugin://%s/' % PLUGIN, '1', '']
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    _module('xbmc', LOGDEBUG=0, LOGNOTICE=2, LOGERROR=4, abortRequested=False,
+            log=lambda *args, **kwargs: None,
+            translatePath=lambda path: path.replace('special://temp', temp),
+            executebuiltin=lambda *args: None,
+            executeJSONRPC=lambda data: '{}',
+            sleep=lambda ms: None)
+    _module('xbmcaddon', Addon=Addon)
+    _module('xbmcgui', ListItem=ListItem, Dialog=ListItem, DialogProgress=ListItem)
+    _module('xbmcplugin', addDirectoryItem=lambda **kwargs: True,
+            endOfDirectory=lambda *args, **kwargs: None,
+            setContent=lambda *args: None, addSortMethod=lambda **kwargs: None)
+    _module('xbmcvfs', exists=os.path.exists, mkdir=_mkdir, File=File)
+    # the real utilities pulls in functions and with it the whole plugin
+    _module('utilities', Debug=lambda *args, **kwargs: None,
+            xbmcJsonRequest=lambda params: None)
+    return temp
+
+def timeit(func, number=1):
+    """Best wall time of number runs, in seconds."""
+    import time
+    best = None
+    for i in range(number):
+        start = time.time()
+        func()
+        took = time.time() - start
+        if best is None or took < best:
+            best = took
+    return best
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""
+Time budget of one plugin invocation, shared by every fetch.
+
+    start     - open the budget, in seconds from now
+    remaining - seconds left, None when no budget was started
+    expired   - True once the budget is spent
+    timeout   - a per-request timeout clipped to what is left
+"""
+
+import time
+
+MINIMUM = 0.5
+
+_deadline = None
+
+def start(seconds):
+    global _deadline
+    _deadline = time.time() + seconds
+
+def remaining():
+    if _deadline is None:
+        return None
+    return max(0.0, _deadline - time.time())
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+def timeout(default):
+    left = remaining()
+    if left is None:
+        return default
+    return max(MINIMUM, min(default, left))
@@ -1,8 +1,10 @@
 ﻿# -*- coding: utf-8 -*-
 
-import urllib, urllib2, re, sys, socket, datetime, time, os, json
+import urllib, urllib2, re, sys, socket, datetime, time, os, json, threading, hashlib
 import xbmcplugin, xbmcgui, xbmc, xbmcaddon, xbmcvfs
 from app import *
+from store import Store, store, bump, flush, counters
+import deadline
 
 try:
     from hashlib import md5
@@ -28,6 +30,7 @@ __tmppath__= os.path.join(__addonpath__, 'tmp')
 forced_refresh_data=__settings__.getSetting("forced_refresh_data")
 refresh_period=int('1|4|12|24'.split('|')[int(__settings__.getSetting("refresh_period"))])
 refresh_always=__settings__.getSetting("refresh_always")
+refresh_background=__settings__.getSetting("refresh_background")
 striplist=['the', 'tonight', 'show', 'with', '  ', '  ', '  ', '  ', '  ', '  ', '  ', '  ', '  ', '  ']
 debug = __settings__.getSetting("debug")
 
@@ -54,9 +57,8 @@ def showMessage(heading, message, times = 10000, forced=False):
         xbmc.executebuiltin('XBMC.Notification("%s", "%s", %s, "%s")'%(heading.encode('utf-8'), unicode(message).encode('utf-8'), times, icon))
 
 def id2title(showId, id=None, norus=False):
-    jload=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).get()
-    if jload:
-        jdata = json.loads(jload)
+    jdata=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).json()
+    if jdata:
         if ruName=='true' and jdata['ruTitle'] and not norus:
             title=jdata['ruTitle']
         else:
@@ -71,19 +73,42 @@ def id2title(showId, id=None, norus=False):
             return title.encode('utf-8'), None
 
 def id2date(showId, id):
-    jload=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).get()
-    if jload:
-        jdata = json.loads(jload)
+    jdata=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).json()
+    if jdata:
         if str(id) in jdata["episodes"]: return jdata["episodes"][str(id)]["airDate"]
 
+class ShowModel:
+    """
+    Indexes over the episodes of one /shows/<id> document.
+
+        by_season  - seasonNumber -> [episode ids]
+        by_se      - (seasonNumber, episodeNumber) -> episode id
+        by_airdate - airDate -> first episode id aired that day
+        by_title   - episode title -> first episode id with that title
+    """
+
+    def __init__(self, jdata):
+        self.jdata=jdata
+        self.episodes=jdata['episodes']
+        self.by_season, self.by_se, self.by_airdate, self.by_title={}, {}, {}, {}
+        for id, ep in self.episodes.iteritems():
+            self.by_season.setdefault(ep['seasonNumber'], []).append(id)
+            self.by_se.setdefault((ep['seasonNumber'], ep['episodeNumber']), id)
+            self.by_airdate.setdefault(ep['airDate'], id)
+            self.by_title.setdefault(ep['title'], id)
+
+    def seasons(self):
+        return sorted(self.by_season)
+
+def show_model(showId):
+    return Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).model()
+
 def date2SE(showId, date):
-    jload=Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).get()
-    if jload:
-        jdata = json.loads(jload)
-        for id in jdata['episodes']:
-            #print jdata['episodes'][id]['airDate']+' NOT '+str(date)
-            if jdata['episodes'][id]['airDate']==str(date):
-                return id, jdata['episodes'][id]['seasonNumber'], jdata['episodes'][id]['episodeNumber']
+    model=show_model(showId)
+    if model:
+        id=model.by_airdate.get(str(date))
+        if id:
+            return id, model.episodes[id]['seasonNumber'], model.episodes[id]['episodeNumber']
 
 def fdate_bigger_ldate(fdate, ldate):
     if int(fdate.split('.')[2])>int(ldate.split('.')[2]):
@@ -190,13 +215,29 @@ def auth():
 def makeapp(s):
     return urllib.quote_plus(json.dumps(s))
 
-def get_url(cookie, url):
+def read_body(conn):
+    from net import Decoder
+    decoder=Decoder(conn.info().getheader('Content-Encoding'))
+    return decoder.decode(conn.read())+decoder.flush()
+
+def get_url(cookie, url, validators=None, timeout=30):
     headers = { 'User-Agent':'XBMC',
                 'Content-Type':'application/x-www-form-urlencoded',
+                'Accept-Encoding':'gzip, deflate',
                 'Cookie':cookie}
+    post=urllib.urlencode({})
+    if validators is not None:
+        # conditional requests are only honoured on GET
+        post=None
+        if validators.get('etag'): headers['If-None-Match']=validators['etag']
+        if validators.get('modified'): headers['If-Modified-Since']=validators['modified']
+    if deadline.expired():
+        Debug('[get_url]: deadline expired, skipping '+url)
+        return False
     try:
-        conn = urllib2.urlopen(urllib2.Request(url, urllib.urlencode({}), headers))
-        array=conn.read()
+        conn = urllib2.urlopen(urllib2.Request(url, post, headers), timeout=deadline.timeout(timeout))
+        array=read_body(conn)
+        get_validators(conn, validators)
         #Debug('[get_url]: arr"'+str(array)+'"')
         if array=='':
             #Debug('[get_url][2]: arr=""')
@@ -204,10 +245,14 @@ def get_url(cookie, url):
         return array
     except urllib2.HTTPError as e:
         #Debug('[get_url]: HTTPError, e.code='+str(e.code))
-        if e.code==401:
+        if e.code==304 and validators is not None:
+            validators['status']=304
+            return
+        elif e.code==401:
             headers['Cookie']=auth()
-            conn = urllib2.urlopen(urllib2.Request(url, urllib.urlencode({}), headers))
-            array=conn.read()
+            conn = urllib2.urlopen(urllib2.Request(url, post, headers), timeout=deadline.timeout(timeout))
+            array=read_body(conn)
+            get_validators(conn, validators)
             conn.close()
             if array=='':
                 ##Debug('[get_url][3]: arr=""')
@@ -220,6 +265,12 @@ def get_url(cookie, url):
     except:
         return False
 
+def get_validators(conn, validators):
+    if validators is not None:
+        validators['status']=conn.getcode()
+        validators['etag']=conn.info().getheader('ETag')
+        validators['modified']=conn.info().getheader('Last-Modified')
+
 def get_html_source(url):
     class AppURLopener(urllib.FancyURLopener):
         version = 'xxx'
@@ -241,37 +292,15 @@ def post_url(cookie, url, post):
                 'Accept':'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
                 'Connection':'keep-alive',
                 'Referer':'http://www.bt-chat.com/search.php?mode=simplesearch',
+                'Accept-Encoding':'gzip, deflate',
                 'Cookie':cookie}
     conn = urllib2.urlopen(urllib2.Request(url, urllib.urlencode(post), headers))
-    array=conn.read()
+    array=read_body(conn)
     conn.close()
     return array
 
-def creat_db(dbfilename):
-    db = sqlite.connect(dbfilename)
-    cur = db.cursor()
-    cur.execute('pragma auto_vacuum=1')
-    cur.execute('create table sources(addtime integer, filename varchar(32) PRIMARY KEY, showId integer, seasonId integer, episodeId integer, id integer, stype varchar(32))')
-    cur.execute('create table cache(addtime integer, url varchar(32))')
-    cur.execute('create table scan(addtime integer, filename varchar(32) PRIMARY KEY)')
-    cur.execute('create table watched(addtime integer, rating integer, id varchar(32) PRIMARY KEY)')
-    db.commit()
-    cur.close()
-    db.close()
-
 def ClearCache():
-    dirname = xbmc.translatePath('special://temp')
-    for subdir in ('xbmcup', sys.argv[0].replace('plugin://', '').replace('/', '')):
-        dirname = os.path.join(dirname, subdir)
-        if not xbmcvfs.exists(dirname):
-            xbmcvfs.mkdir(dirname)
-    dbfilename = os.path.join(dirname, 'data.db3')
-    db = sqlite.connect(dbfilename)
-    cur = db.cursor()
-    cur.execute('delete from cache')
-    db.commit()
-    cur.close()
-    db.close()
+    store().execute('delete from cache')
     xbmcgui.Dialog().ok( __language__(30208), __language__(30236))
     ontop('update')
     xbmc.executebuiltin("Action(back)")
@@ -286,42 +315,17 @@ def getSettingAsBool(setting):
 
 class CacheDB:
     def __init__(self, url):
-        dirname = xbmc.translatePath('special://temp')
-        for subdir in ('xbmcup', sys.argv[0].replace('plugin://', '').replace('/', '')):
-            dirname = os.path.join(dirname, subdir)
-            if not xbmcvfs.exists(dirname):
-                xbmcvfs.mkdir(dirname)
-        self.dbfilename = os.path.join(dirname, 'data.db3')
         self.url=url
-        if not xbmcvfs.exists(self.dbfilename):
-            creat_db(self.dbfilename)
 
     def get(self):
-        self._connect()
-        self.cur.execute('select addtime from cache where url="'+self.url+'"')
-        x=self.cur.fetchone()
-        self._close()
+        x=store().fetchone('select addtime from cache where url=?', (self.url,))
         return x[0] if x else None
 
     def add(self):
-        self._connect()
-        self.cur.execute('insert into cache(addtime, url) values(?,?)', (int(time.time()), self.url))
-        self.db.commit()
-        self._close()
+        store().execute('insert into cache(addtime, url) values(?,?)', (int(time.time()), self.url))
 
     def delete(self):
-        self._connect()
-        self.cur.execute('delete from cache where url="'+self.url+'"')
-        self.db.commit()
-        self._close()
-
-    def _connect(self):
-        self.db = sqlite.connect(self.dbfilename)
-        self.cur = self.db.cursor()
-
-    def _close(self):
-        self.cur.close()
-        self.db.close()
+        store().execute('delete from cache where url=?', (self.url,))
 
 def auto_scan():
     from torrents import ScanAll
@@ -335,13 +339,74 @@ def auto_scan():
             ScanAll()
     except: showMessage(__language__(30279), __language__(30277))
 
+_parsed={}
+_models={}
+JSON_CHUNK=64*1024
+RE_JSON_SPACE=re.compile(r'[ \t\n\r]*')
+JSON_DELIMITERS=' \t\n\r,]'
+
+def iterjson(f, chunk=JSON_CHUNK):
+    """
+    Yields the elements of the top-level JSON array in file f one by one,
+    holding no more than one element and one chunk in memory.
+    """
+    decoder=json.JSONDecoder()
+    # open - ждем '[', first - значение или ']', value - значение, separator - ',' или ']'
+    buf, pos, eof, state='', 0, False, 'open'
+    while True:
+        pos=RE_JSON_SPACE.match(buf, pos).end()
+        if pos<len(buf):
+            if state=='open':
+                if buf[pos]!='[': raise ValueError('Not a JSON array')
+                pos, state=pos+1, 'first'
+                continue
+            if state=='separator':
+                if buf[pos]==',':
+                    pos, state=pos+1, 'value'
+                    continue
+                if buf[pos]==']':
+                    return
+                raise ValueError('Expecting , or ] at char %d of the chunk' % pos)
+            if state=='first' and buf[pos]==']':
+                return
+            try:
+                obj, end=decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof: raise
+            else:
+                # 2.5e3, cut after '2.' by the chunk border, decodes as 2: take a value
+                # only when a delimiter follows it, otherwise read on
+                if eof or end<len(buf) and buf[end] in JSON_DELIMITERS:
+                    yield obj
+                    pos, state=end, 'separator'
+                    continue
+        if eof: raise ValueError('Unterminated JSON array')
+        data=f.read(chunk)
+        if not data: eof=True
+        buf, pos=buf[pos:]+data, 0
+
+__cachepath__=os.path.join(__tmppath__, 'cache')
+CACHE_SIZE=20*1024*1024
+# first match wins, ttl None means the url is an action and is never cached
+CACHE_TTL=(
+    ('http://api.myshows.ru/profile/episodes/(check|uncheck|rate|favorites|ignored)/', None),
+    ('http://api.myshows.ru/profile/shows/\d+/.', None),
+    ('http://myshows.ru/xbmchub', None),
+    ('http://api.myshows.ru/profile/news/', 3600),
+    ('http://api.myshows.ru/shows/search/', 24*3600),
+    ('http://(api\.)?myshows.ru/', refresh_period*3600),
+)
+
 class Data():
     def __init__(self, cookie_auth, url, refresh_url=None):
-        if not xbmcvfs.exists(__tmppath__):
-            xbmcvfs.mkdir(__tmppath__)
+        for dirname in (__tmppath__, __cachepath__):
+            if not xbmcvfs.exists(dirname):
+                xbmcvfs.mkdir(dirname)
         self.cookie=cookie_auth
+        self.ttl = self.url2ttl(url)
         self.filename = self.url2filename(url)
         self.refresh=False
+        self.stale=False
         if refresh_url:
             CacheDB(unicode(refresh_url)).delete()
             if re.search('profile', refresh_url):
@@ -351,15 +416,24 @@ class Data():
             if not xbmcvfs.exists(self.filename) \
                 or forced_refresh_data=='true' \
                 or not CacheDB(self.url).get() \
-                or int(time.time())-CacheDB(self.url).get()>refresh_period*3600 \
                 or str(refresh_always)=='true':
                 self.refresh=True
                 __settings__.setSetting("forced_refresh_data","false")
+            elif int(time.time())-CacheDB(self.url).get()>self.ttl:
+                if refresh_background=='true': self.stale=True
+                else: self.refresh=True
+
+    def prepare(self):
+        if self.refresh==True or not xbmcvfs.File(self.filename, 'r').size():
+            if deadline.expired() and xbmcvfs.File(self.filename, 'r').size():
+                Debug('[Data][get] Deadline expired, serving cached '+self.url)
+            else: self.write()
+        elif self.stale:
+            self.revalidate()
 
     def get(self):
         if self.filename:
-            if self.refresh==True or not xbmcvfs.File(self.filename, 'r').size():
-                self.write()
+            self.prepare()
             self.fg = xbmcvfs.File(self.filename, 'r')
             try:self.data = self.fg.read()
             except:
@@ -367,51 +441,158 @@ class Data():
                 self.fg = open(self.filename, 'r')
                 self.data = self.fg.read()
             self.fg.close()
-            x=re.match('.*?}$', self.data)
-            if not x: self.data=self.data[0:len(self.data)-1]
+            self.touch()
             return self.data
         else: return get_url(self.cookie, self.url)
 
+    def json(self):
+        """Parsed response, memoized per process while the cache file is unchanged.
+        Every caller gets the same object: treat it as read-only and copy before changing it."""
+        if not self.filename:
+            data=self.get()
+            return json.loads(data) if data else None
+        if not self.refresh and self.url in _parsed:
+            mtime, jdata=_parsed[self.url]
+            if xbmcvfs.exists(self.filename) and mtime==os.path.getmtime(self.filename):
+                return jdata
+        data=self.get()
+        if not data: return None
+        jdata=json.loads(data)
+        _parsed[self.url]=(os.path.getmtime(self.filename), jdata)
+        return jdata
+
+    def stream(self):
+        """Elements of a JSON array response, decoded lazily from the cache file."""
+        if not self.filename:
+            return iter(self.json() or [])
+        if not self.refresh and self.url in _parsed:
+            mtime, jdata=_parsed[self.url]
+            if xbmcvfs.exists(self.filename) and mtime==os.path.getmtime(self.filename):
+                return iter(jdata)
+        self.prepare()
+        if not os.path.exists(self.filename): return iter([])
+        self.touch()
+        return self._stream()
+
+    def _stream(self):
+        with open(self.filename, 'r') as f:
+            for obj in iterjson(f):
+                yield obj
+
+    def model(self):
+        jdata=self.json()
+        if jdata is None: return None
+        # модель живет, пока жив разобранный документ
+        if self.url in _models and _models[self.url][0] is jdata:
+            return _models[self.url][1]
+        model=ShowModel(jdata)
+        _models[self.url]=(jdata, model)
+        return model
+
+    def revalidate(self):
+        lockname=self.filename+'.lock'
+        try:
+            if time.time()-os.path.getmtime(lockname)>60: os.remove(lockname)
+        except OSError: pass
+        try: os.close(os.open(lockname, os.O_CREAT|os.O_EXCL|os.O_WRONLY))
+        except OSError:
+            Debug('[Data][revalidate] Already refreshing '+self.url)
+            return
+        def refresh():
+            try:
+                Data(self.cookie, self.url).write()
+                flush()
+            finally:
+                try: os.remove(lockname)
+                except OSError: pass
+        Debug('[Data][revalidate] Refreshing in background '+self.url)
+        threading.Thread(target=refresh).start()
+
     def write(self):
+        validators=self.readmeta()
         try: CacheDB(self.url).delete()
         except: pass
-        self.data=get_url(self.cookie, self.url)
+        self.data=get_url(self.cookie, self.url, validators)
+        if validators.get('status')==304:
+            Debug('[Data][write] Not modified '+self.url)
+            bump('http_304')
+            bump('bytes_saved', os.path.getsize(self.filename))
+            CacheDB(self.url).add()
+            return
+        _parsed.pop(self.url, None)
         if self.data:
-            try:
-                self.fw = xbmcvfs.File(self.filename, 'w')
-            except:
-                self.fw = open(self.filename, 'w')
+            bump('http_200')
+            if self.data!=True: bump('bytes_200', len(self.data))
+            tmpname='%s.%d.tmp' % (self.filename, threading.current_thread().ident)
+            self.fw = open(tmpname, 'wb')
             self.fw.write(self.data)
             self.fw.close()
+            try: os.rename(tmpname, self.filename)
+            except OSError:
+                os.remove(self.filename)
+                os.rename(tmpname, self.filename)
+            self.writemeta(validators)
             CacheDB(self.url).add()
+            self.evict()
+
+    def readmeta(self):
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename+'.meta', 'r') as fm:
+                    return json.load(fm)
+            except (IOError, ValueError): pass
+        return {}
+
+    def writemeta(self, validators):
+        metaname=self.filename+'.meta'
+        if validators.get('etag') or validators.get('modified'):
+            with open(metaname, 'w') as fm:
+                json.dump({'etag': validators.get('etag'), 'modified': validators.get('modified')}, fm)
+        elif os.path.exists(metaname):
+            os.remove(metaname)
+
+    def touch(self):
+        try: os.utime(self.filename, (time.time(), os.path.getmtime(self.filename)))
+        except OSError: pass
+
+    def evict(self):
+        files, size=[], 0
+        for name in os.listdir(__cachepath__):
+            if name.endswith('.txt'):
+                st=os.stat(os.path.join(__cachepath__, name))
+                files.append((st.st_atime, st.st_size, name))
+                size+=st.st_size
+        files.sort()
+        for atime, fsize, name in files:
+            if size<=CACHE_SIZE: break
+            try: os.remove(os.path.join(__cachepath__, name))
+            except OSError: continue
+            try: os.remove(os.path.join(__cachepath__, name+'.meta'))
+            except OSError: pass
+            size-=fsize
+            Debug('[Data][evict] '+name)
+
+    def url2ttl(self, url):
+        for pattern, ttl in CACHE_TTL:
+            if re.match(pattern, url):
+                return ttl
 
     def url2filename(self, url):
-        self.files=[r'shows.txt', r'showId_%s.txt', r'watched_showId_%s.txt', r'action_%s.txt', r'top_%s.txt']
-        self.urls=['http://api.myshows.ru/profile/shows/$', 'http://api.myshows.ru/shows/(\d{1,20}?$)', 'http://api.myshows.ru/profile/shows/(\d{1,20}?)/$', 'http://api.myshows.ru/profile/episodes/(unwatched|next)/', 'http://api.myshows.ru/shows/top/(all|male|female)/']
-        self.i=-1
-        for file in self.urls:
-            self.i=self.i+1
-            self.match=re.compile(str(file)).findall(url)
-            if self.match:
-                self.var=str(self.match[0])
-                if str(self.files[self.i]).endswith('%s.txt'):
-                    return os.path.join(__tmppath__, self.files[self.i] % (self.var))
-                else:
-                    return os.path.join(__tmppath__, self.files[self.i])
-        return None
+        if self.ttl:
+            if isinstance(url, unicode): url=url.encode('utf-8')
+            return os.path.join(__cachepath__, hashlib.md5(url).hexdigest()+'.txt')
 
 def friend_xbmc():
     login=__settings__.getSetting("username").decode('utf-8','ignore')
     filename=os.path.join(__tmppath__, '%s.txt' %(login))
     if xbmcvfs.File(filename, 'r').size():
         return True
-    socket.setdefaulttimeout(3)
     scan=CacheDB(login)
     if scan.get() and int(time.time())-scan.get()>refresh_period*3600 or not scan.get():
         scan.delete()
         scan.add()
         url='http://myshows.ru/xbmchub?friend-me'
-        ok=Data(cookie_auth, url, '').get()
+        ok=get_url(cookie_auth, url, timeout=3)
         try:
             if ok or not ok:
                 try:
@@ -431,7 +612,7 @@ def ontop(action='get', ontop=None):
     from torrents import prefix
     if action in ('update'):
         if ontop:
-            jdata = json.loads(Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').get())
+            jdata = Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').json()
             jstringdata=json.loads(ontop)
             showId=str(jstringdata['showId'])
             pre=prefix(showId=int(showId), seasonId=jstringdata['seasonId'])
@@ -788,8 +969,7 @@ class PluginStatus():
         from torrents import TorrentDB
         from net import Download
 
-        socket.setdefaulttimeout(3)
-        if Download().list():
+        if Download(timeout=3).list():
             utorrentstatus=unicode(__language__(30147))
         else:
             utorrentstatus=unicode(__language__(30148))
@@ -973,7 +1153,7 @@ class RateShow():
         else:
             watched_data= Data(cookie_auth, 'http://api.myshows.ru/profile/shows/'+str(showId)+'/',
                                'http://api.myshows.ru/profile/shows/'+str(showId)+'/')
-            try:self.watched_jdata = json.loads(watched_data.get())
+            try:self.watched_jdata = watched_data.json()
             except:
                 Debug('[RateShow] no watched_jdata1')
                 return
@@ -982,8 +1162,7 @@ class RateShow():
                 return
 
     def seasonrates(self):
-        jload=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').get()
-        jshowdata = json.loads(jload)
+        jshowdata=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').json()
         if str(self.showId) in jshowdata:
             self.list, seasonNumber=self.listSE(jshowdata[str(self.showId)]['totalEpisodes'])
             ratedict={}
@@ -1006,8 +1185,7 @@ class RateShow():
     def count(self):
         ratings,seasonratings=[],[]
         showId=str(self.showId)
-        jload=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').get()
-        jshowdata = json.loads(jload)
+        jshowdata=Data(cookie_auth, 'http://api.myshows.ru/profile/shows/').json()
         self.list, seasonNumber=self.listSE(jshowdata[showId]['totalEpisodes'])
         old_rating=jshowdata[showId]['rating']
         for id in self.watched_jdata:
@@ -1026,16 +1204,13 @@ class RateShow():
 
     def listSE(self,maxep):
         listSE,seasonNumber={},0
-        data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(self.showId))
-        jdata = json.loads(data.get())
-        for id in jdata['episodes']:
-            if maxep>=jdata['episodes'][id]['sequenceNumber']:
-                if listSE.has_key(str(jdata['episodes'][id]['seasonNumber'])):
-                    listSE[str(jdata['episodes'][id]['seasonNumber'])].append(id)
-                else:
-                    listSE[str(jdata['episodes'][id]['seasonNumber'])]=[id]
-                if jdata['episodes'][id]['seasonNumber']>seasonNumber:
-                    seasonNumber=jdata['episodes'][id]['seasonNumber']
+        model=show_model(self.showId)
+        for season, ids in model.by_season.iteritems():
+            ids=[id for id in ids if maxep>=model.episodes[id]['sequenceNumber']]
+            if ids:
+                listSE[str(season)]=ids
+                if season>seasonNumber:
+                    seasonNumber=season
         #Debug('[listSE] '+str(listSE)+str(seasonNumber))
         return listSE, seasonNumber
 
@@ -1052,10 +1227,10 @@ def isRemoteTorr():
 
 def season_banner(banners, season):
     import random
-    try:season_banners = [banner for banner in banners if banner["bannertype"] == "season" and int(banner["season"]) == season]
+    try:season_banners = banners['season'].get(int(season), [])
     except:season_banners=[]
     if len(season_banners)>0:
-        return season_banners[random.randint(0, len(season_banners)-1)]["bannerpath"]
+        return random.choice(season_banners)
 
 def titlesync(id):
     title=id
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+Snapshot of the XBMC video library, kept in library.json next to data.db3
+so listings do not walk JSON-RPC show by show.
+
+    shows   - every library show with its episodes, loaded once per process
+    find    - library show by title, exact match first, then substring
+    has     - True if the library holds the show's season/episode
+    path    - file of the show's season/episode, None if not in the library
+    refresh - re-read the library, fetching episodes only for changed shows
+"""
+
+import os, time, json
+
+from utilities import Debug, xbmcJsonRequest
+from store import store, bump
+
+# without a databaseUpdated notification the snapshot is re-checked daily
+TTL = 24*60*60
+
+SHOW_PROPERTIES = ['title', 'originaltitle', 'genre', 'year', 'rating', 'plot', 'studio', 'mpaa', 'cast', 'imdbnumber', 'premiered', 'votes', 'fanart', 'thumbnail', 'episodeguide', 'playcount', 'season', 'episode', 'tag']
+
+_shows = None
+_titles = {}
+_files = {}
+_episodes = set()
+_found = {}
+
+def filename():
+    return os.path.join(os.path.dirname(store().filename), 'library.json')
+
+def shows():
+    global _shows
+    if _shows is None:
+        snapshot = None
+        try:
+            if time.time() - os.path.getmtime(filename()) < TTL:
+                with open(filename(), 'r') as f:
+                    snapshot = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+        if snapshot is None:
+            snapshot = refresh()
+        # refresh() indexes the snapshot it saved, only a failed refresh leaves nothing indexed
+        if _shows is None:
+            _index(snapshot)
+    return _shows
+
+def find(title):
+    if not shows():
+        return None
+    key = _key(title)
+    if key not in _found:
+        show = _titles.get(key)
+        if show is None:
+            # the substring scan runs once per title, misses are remembered too
+            show = next((x for x in _shows if key in _key(x['title'])), None)
+        _found[key] = show
+    return _found[key]
+
+def has(title, season, episode):
+    if not shows():
+        return False
+    if (_key(title), int(season), int(episode)) in _episodes:
+        return True
+    return path(title, season, episode) is not None
+
+def path(title, season, episode):
+    show = find(title)
+    if show is None:
+        return None
+    return _files.get((show['tvshowid'], int(season), int(episode)))
+
+def refresh():
+    result = xbmcJsonRequest({'jsonrpc': '2.0', 'method': 'VideoLibrary.GetTVShows', 'params': {'properties': SHOW_PROPERTIES}, 'id': 0})
+    if not result or 'tvshows' not in result:
+        Debug('[Library] xbmc json request was empty.')
+        return []
+    old = {}
+    try:
+        with open(filename(), 'r') as f:
+            old = dict((x['tvshowid'], x) for x in json.load(f))
+    except (IOError, OSError, ValueError):
+        pass
+
+    snapshot = []
+    for show in result['tvshows']:
+        prev = old.get(show['tvshowid'])
+        # episode holds the number of episodes in the library, playcount the watched ones
+        if prev and prev.get('episode') == show.get('episode') and prev.get('playcount') == show.get('playcount'):
+            show['episodes'] = prev['episodes']
+        else:
+            bump('library_show_fetches')
+            episodes = xbmcJsonRequest({'jsonrpc': '2.0', 'method': 'VideoLibrary.GetEpisodes', 'params': {'tvshowid': show['tvshowid'], 'properties': ['season', 'episode', 'playcount', 'uniqueid', 'file']}, 'id': 0})
+            show['episodes'] = [x for x in (episodes or {}).get('episodes', []) if isinstance(x, dict)]
+        snapshot.append(show)
+
+    tmpname = filename() + '.tmp'
+    with open(tmpname, 'w') as f:
+        json.dump(snapshot, f)
+    try: os.rename(tmpname, filename())
+    except OSError:
+        os.remove(filename())
+        os.rename(tmpname, filename())
+    Debug('[Library] Snapshot of %d shows saved' % len(snapshot))
+    _index(snapshot)
+    return snapshot
+
+def _key(title):
+    if isinstance(title, str):
+        title = title.decode('utf-8', 'ignore')
+    return title.lower().strip()
+
+def _index(snapshot):
+    global _shows, _titles, _files, _episodes, _found
+    _shows = snapshot
+    _titles = dict((_key(x['title']), x) for x in snapshot)
+    _files = dict(((x['tvshowid'], e['season'], e['episode']), e.get('file')) for x in snapshot for e in x['episodes'])
+    _episodes = set((_key(x['title']), e['season'], e['episode']) for x in snapshot for e in x['episodes'])
+    _found = {}
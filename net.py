@@ -11,11 +11,24 @@ import base64
 import mimetools
 import json
 import itertools
+import zlib
+import socket
+import httplib
+import threading
+import hashlib
+import shutil
 
 from utilities import Debug
+from store import bump
+import deadline
 _IS_LIBTORRENT = True
 import xbmc, xbmcgui, xbmcaddon, xbmcvfs
 __settings__ = xbmcaddon.Addon(id='plugin.video.myshows')
+_downloads = {}
+_downloads_lock = threading.Lock()
+# a download lock not refreshed for this long belongs to a dead process
+DOWNLOAD_LOCK_STALE = 120
+
 RE = {
     'content-disposition': re.compile('attachment;\sfilename="*([^"\s]+)"|\s')
 }
@@ -27,7 +40,8 @@ RE = {
 # ################################
 
 class HTTP:
-    def __init__(self):
+    def __init__(self, timeout=None):
+        self.timeout = timeout
         self._dirname = xbmc.translatePath('special://temp')#.decode('utf-8').encode('cp1251')
         for subdir in ('xbmcup', sys.argv[0].replace('plugin://', '').replace('/', '')):
             self._dirname = os.path.join(self._dirname, subdir)
@@ -47,11 +61,16 @@ class HTTP:
         
         try:
             self._opener()
-            self._fetch()
+            if self.request.download:
+                self._fetch_download()
+            else:
+                self._fetch()
         except Exception, e:
             xbmc.log('XBMCup: HTTP: ' + str(e), xbmc.LOGERROR)
             if isinstance(e, urllib2.HTTPError):
                 self.response.code = e.code
+                # frees the pooled connection behind the error body
+                e.close()
             self.response.error = e
         else:
             self.response.code = 200
@@ -77,7 +96,7 @@ class HTTP:
     
     def _opener(self):
         
-        build = [urllib2.HTTPHandler()]
+        build = [KeepAliveHandler(self._timeout(self.request.connect_timeout))]
         
         if self.request.redirect:
             build.append(urllib2.HTTPRedirectHandler())
@@ -97,10 +116,87 @@ class HTTP:
                 self.cookies.load(self.request.cookies)
             build.append(urllib2.HTTPCookieProcessor(self.cookies))
                 
-        urllib2.install_opener( urllib2.build_opener(*build) )
+        self.opener = urllib2.build_opener(*build)
+    
+    
+    def _timeout(self, value):
+        if self.timeout:
+            value = min(value, self.timeout)
+        return deadline.timeout(value)
+    
+    
+    def _fetch_download(self):
+        # concurrent downloads of one url share a single transfer into a
+        # common file, every caller then gets its own copy
+        key = self.request.url
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        base = os.path.join(self._dirname, 'download_' + hashlib.md5(key).hexdigest())
+        with _downloads_lock:
+            slot = _downloads.get(key)
+            leader = slot is None
+            if leader:
+                slot = _downloads[key] = {'event': threading.Event(), 'error': None, 'headers': {}, 'users': 0,
+                                          'shared': base, 'locked': self._download_lock(base)}
+                if not slot['locked']:
+                    # another plugin process is writing base.part, keep off its files
+                    bump('download_busy')
+                    slot['shared'] = '%s_%d' % (base, os.getpid())
+            slot['users'] += 1
+        shared = slot['shared']
+        
+        try:
+            if leader:
+                try:
+                    self._fetch(shared)
+                    slot['headers'] = self.response.headers
+                except Exception, e:
+                    slot['error'] = e
+                    raise
+                finally:
+                    slot['event'].set()
+            else:
+                bump('download_shared')
+                slot['event'].wait()
+                if slot['error']:
+                    raise slot['error']
+                self.response.headers = slot['headers']
+            shutil.copyfile(shared, self.request.download)
+            self.response.filename = self.request.download
+        finally:
+            with _downloads_lock:
+                slot['users'] -= 1
+                if not slot['users']:
+                    del _downloads[key]
+                    if os.path.isfile(shared):
+                        os.remove(shared)
+                    if slot['locked']:
+                        try: os.remove(shared + '.lock')
+                        except OSError: pass
+                    else:
+                        # nobody resumes a pid-named part
+                        self._download_clear(shared)
+    
+    
+    def _download_lock(self, shared):
+        # only the process holding shared.lock may write or resume shared.part
+        lock = shared + '.lock'
+        try:
+            if time.time() - os.path.getmtime(lock) > DOWNLOAD_LOCK_STALE:
+                os.remove(lock)
+        except OSError:
+            pass
+        try:
+            os.close(os.open(lock, os.O_CREAT|os.O_EXCL|os.O_WRONLY))
+        except OSError:
+            return False
+        return True
     
     
-    def _fetch(self):
+    def _fetch(self, target=None):
+        if deadline.expired():
+            raise urllib2.URLError('deadline expired')
+        
         params = {} if self.request.params is None else self.request.params
         
         if self.request.upload:
@@ -119,6 +215,18 @@ class HTTP:
         for key, value in self.request.headers.iteritems():
             req.add_header(key, value)
         
+        resume = 0
+        if target and os.path.isfile(target + '.part'):
+            resume = os.path.getsize(target + '.part')
+        if resume:
+            # byte offsets are only stable on the identity encoding
+            req.add_header('Range', 'bytes=%d-' % resume)
+            if os.path.isfile(target + '.tag'):
+                with open(target + '.tag', 'rb') as fd:
+                    req.add_header('If-Range', fd.read())
+        elif self.request.gzip:
+            req.add_header('Accept-Encoding', 'gzip, deflate')
+        
         if self.request.upload:
             req.add_header('Content-type', 'multipart/form-data; boundary=%s' % boundary)
             req.add_header('Content-length', len(upload))
@@ -126,33 +234,54 @@ class HTTP:
         if self.request.auth_username and self.request.auth_password:
             req.add_header('Authorization', 'Basic %s' % base64.encodestring(':'.join([self.request.auth_username, self.request.auth_password])).strip())
         
-        #self.con = urllib2.urlopen(req, timeout=self.request.timeout)
-        self.con = urllib2.urlopen(req)
+        try:
+            self.con = self.opener.open(req, timeout=self._timeout(self.request.timeout))
+        except urllib2.HTTPError, e:
+            if e.code == 416:
+                self._download_clear(target)
+            raise
         self.response.headers = self._headers( self.con.info() )
+        self.decoder = Decoder(self.response.headers.get('content-encoding'))
         
-        if self.request.download:
-            self._download()
+        if target:
+            self._download(target, resume)
         else:
-            self.response.body = self.con.read()
+            self.response.body = self.decoder.decode(self.con.read()) + self.decoder.flush()
         
         if self.request.cookies:
             self.cookies.save(self.request.cookies)
     
     
-    def _download(self):
-        fd = open(self.request.download, 'wb')
+    def _download(self, target, resume=0):
+        part = target + '.part'
+        if resume and self.con.getcode() == 206:
+            bump('download_resumed')
+            self.fd = open(part, 'ab')
+        else:
+            resume = 0
+            self.fd = open(part, 'wb')
+            tag = self.response.headers.get('etag') or self.response.headers.get('last-modified')
+            if tag:
+                with open(target + '.tag', 'wb') as fd:
+                    fd.write(tag)
+            elif os.path.isfile(target + '.tag'):
+                os.remove(target + '.tag')
+        
         if self.request.progress:
             self.progress = xbmcgui.DialogProgress()
             self.progress.create(u'Download')
         
-        bs = 1024*8
+        # the buffer doubles while reads come back full, up to 1 MB
+        bs = 1024*64
         size = -1
-        read = 0
+        read = resume
         name = None
+        updated = 0
+        touched = time.time()
         
         if self.request.progress:
             if 'content-length' in self.response.headers:
-                size = int(self.response.headers['content-length'])
+                size = resume + int(self.response.headers['content-length'])
             if 'content-disposition' in self.response.headers:
                 r = RE['content-disposition'].search(self.response.headers['content-disposition'])
                 if r:
@@ -161,14 +290,37 @@ class HTTP:
         while 1:
             buf = self.con.read(bs)
             if buf == '':
+                self.fd.write(self.decoder.flush())
                 break
             read += len(buf)
-            fd.write(buf)
+            self.fd.write(self.decoder.decode(buf))
+            if len(buf) == bs and bs < 1024*1024:
+                bs *= 2
+            
+            if time.time() - touched > DOWNLOAD_LOCK_STALE/4:
+                # keeps a long download from looking abandoned
+                touched = time.time()
+                try: os.utime(target + '.lock', None)
+                except OSError: pass
             
-            if self.request.progress:
+            if self.request.progress and time.time() - updated > 0.5:
+                updated = time.time()
                 self.progress.update(*self._progress(read, size, name))
         
-        self.response.filename = self.request.download
+        self.fd.close()
+        self.fd = None
+        if os.path.isfile(target):
+            os.remove(target)
+        os.rename(part, target)
+        if os.path.isfile(target + '.tag'):
+            os.remove(target + '.tag')
+        self.response.filename = target
+    
+    
+    def _download_clear(self, target):
+        for name in (target + '.part', target + '.tag'):
+            if os.path.isfile(name):
+                os.remove(name)
     
     
     def _upload(self, upload, params):
@@ -241,8 +393,175 @@ class HTTP:
         else:
             return u'%10.2f %s' % (float(size)/float(factor), human)
 
+class ConnectionPool:
+    """
+    Idle keep-alive connections per host, shared by every HTTP instance
+    in the process. At most `limit` requests run against one host at a
+    time; a caller that waits longer than its timeout goes ahead anyway.
+    """
+    
+    def __init__(self, size=4, limit=4):
+        self.size = size
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.idle = {}
+        self.busy = {}
+    
+    def get(self, host, timeout):
+        with self.cond:
+            self._acquire(host, timeout)
+            conns = self.idle.get(host)
+            if conns:
+                bump('http_reused')
+                return conns.pop(), True
+        bump('http_connects')
+        return httplib.HTTPConnection(host, timeout=timeout), False
+    
+    def put(self, host, con):
+        with self.cond:
+            self._release(host)
+            conns = self.idle.setdefault(host, [])
+            if len(conns) < self.size:
+                conns.append(con)
+                return
+        con.close()
+    
+    def discard(self, host, con):
+        with self.cond:
+            self._release(host)
+        con.close()
+    
+    def _acquire(self, host, timeout):
+        if not isinstance(timeout, (int, float)):
+            timeout = 30
+        end = time.time() + timeout
+        while self.busy.get(host, 0) >= self.limit:
+            left = end - time.time()
+            if left <= 0:
+                bump('http_host_waits_expired')
+                break
+            self.cond.wait(left)
+        self.busy[host] = self.busy.get(host, 0) + 1
+    
+    def _release(self, host):
+        self.busy[host] = max(0, self.busy.get(host, 0) - 1)
+        self.cond.notify()
+
+_pool = ConnectionPool()
+
+class PooledSocket:
+    """
+    Socket-like wrapper for socket._fileobject: hands the connection back
+    to the pool once the response body has been read to the end.
+    """
+    
+    def __init__(self, host, con, response):
+        self.host, self.con, self.response = host, con, response
+        self.released = False
+    
+    def recv(self, amt):
+        data = self.response.read(amt)
+        if self.response.isclosed() and not self.released:
+            self.released = True
+            if self.response.will_close:
+                _pool.discard(self.host, self.con)
+            else:
+                _pool.put(self.host, self.con)
+        return data
+    
+    def close(self):
+        if not self.released:
+            self.released = True
+            _pool.discard(self.host, self.con)
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+    def __init__(self, connect_timeout=None):
+        urllib2.HTTPHandler.__init__(self)
+        self.connect_timeout = connect_timeout
+    
+    def http_open(self, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        
+        con, reused = _pool.get(host, req.timeout)
+        try:
+            response = self._request(con, req)
+        except (socket.error, httplib.HTTPException), e:
+            if not reused or isinstance(e, socket.timeout):
+                _pool.discard(host, con)
+                raise urllib2.URLError(e)
+            # the server dropped an idle connection, retry on a fresh one
+            con.close()
+            con = httplib.HTTPConnection(host, timeout=req.timeout)
+            bump('http_connects')
+            try:
+                response = self._request(con, req)
+            except (socket.error, httplib.HTTPException), e:
+                _pool.discard(host, con)
+                raise urllib2.URLError(e)
+        
+        fp = socket._fileobject(PooledSocket(host, con, response), close=True)
+        resp = urllib.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+    
+    def _request(self, con, req):
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+        if con.sock is None:
+            if self.connect_timeout:
+                con.timeout = self.connect_timeout
+            con.connect()
+        if req.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            con.sock.settimeout(req.timeout)
+        con.request(req.get_method(), req.get_selector(), req.data, headers)
+        return con.getresponse(buffering=True)
+
+class Decoder:
+    """
+    Streaming gzip/deflate decoder for a Content-Encoding, counts the
+    bytes read off the wire against the bytes handed to the caller.
+    """
+    
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.wire, self.body = 0, 0
+        if encoding == 'gzip':
+            self.obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self.obj = zlib.decompressobj()
+        else:
+            self.obj = None
+    
+    def decode(self, buf):
+        first = not self.wire
+        self.wire += len(buf)
+        if self.obj:
+            try:
+                buf = self.obj.decompress(buf)
+            except zlib.error:
+                # some servers send raw deflate without the zlib header
+                if not (first and self.encoding == 'deflate'):
+                    raise
+                self.obj = zlib.decompressobj(-zlib.MAX_WBITS)
+                buf = self.obj.decompress(buf)
+        self.body += len(buf)
+        return buf
+    
+    def flush(self):
+        buf = self.obj.flush() if self.obj else ''
+        self.body += len(buf)
+        bump('http_wire_bytes', self.wire)
+        bump('http_body_bytes', self.body)
+        return buf
+
 class HTTPRequest:
-    def __init__(self, url, method='GET', headers=None, cookies=None, params=None, upload=None, download=None, progress=False, auth_username=None, auth_password=None, proxy_protocol='http', proxy_host=None, proxy_port=None, proxy_username=None, proxy_password='', timeout=20.0, redirect=True, gzip=False):
+    def __init__(self, url, method='GET', headers=None, cookies=None, params=None, upload=None, download=None, progress=False, auth_username=None, auth_password=None, proxy_protocol='http', proxy_host=None, proxy_port=None, proxy_username=None, proxy_password='', timeout=20.0, connect_timeout=5.0, redirect=True, gzip=True):
         
         if headers is None:
             headers = {}
@@ -269,6 +588,7 @@ class HTTPRequest:
         self.proxy_password = proxy_password
         
         self.timeout = timeout
+        self.connect_timeout = connect_timeout
         
         self.redirect = redirect
         
@@ -771,7 +1091,8 @@ class Transmission:
         return mapping[code]
 
 class Download():
-    def __init__(self):
+    def __init__(self, timeout=None):
+        self.timeout = timeout
         self.handle()
 
     def handle(self):
@@ -784,6 +1105,7 @@ class Download():
             self.client = Transmission()
 
         self.client.config(host=config['host'], port=config['port'], login=config['login'], password=config['password'], url=config['url'])
+        self.client.http.timeout = self.timeout
         #print(self.client.list())
         return True
 
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """ Handles notifications from XBMC via its own thread and forwards them on to the scrobbler """
 
-import sys, re
+import sys, re, time
 import xbmc
 import xbmcaddon
 import xbmcgui
@@ -16,9 +16,14 @@ from myshowsapi import myshowsAPI
 from utilities import Debug, checkScrobblingExclusion, xbmcJsonRequest
 from scrobbler import Scrobbler
 
+# warm the plugin cache after WARM_IDLE seconds without input, at most once per WARM_INTERVAL
+WARM_IDLE = 5*60
+WARM_INTERVAL = 30*60
+
 class NotificationService:
 
     _scrobbler = None
+    _warmed = 0
     
     def __init__(self):
         self.run()
@@ -51,6 +56,9 @@ class NotificationService:
             self._scrobbler.playbackSeek()
         elif action == "scanStarted":
             pass
+        elif action == "databaseUpdated":
+            # refresh the plugin's library snapshot
+            xbmc.executebuiltin('XBMC.RunPlugin("plugin://plugin.video.myshows/?mode=81")')
         elif action == "settingsChanged":
             Debug("[Notification] Settings changed, reloading.")
             globals.myshowsapi.updateSettings()
@@ -73,6 +81,7 @@ class NotificationService:
         # start loop for events
         while (not xbmc.abortRequested):
             xbmc.sleep(500)
+            self._warm()
             
         # we aborted
         if xbmc.abortRequested:
@@ -86,6 +95,20 @@ class NotificationService:
             Debug("[Notification] Joining scrobbler thread to wait for exit.")
             self._scrobbler.join()
 
+    def _warm(self):
+        if time.time() - self._warmed < WARM_INTERVAL:
+            return
+        if self.Player.isPlaying() or xbmc.getGlobalIdleTime() < WARM_IDLE:
+            return
+        try:
+            if xbmcaddon.Addon("plugin.video.myshows").getSetting("warm_cache") != "true":
+                return
+        except:
+            return
+        self._warmed = time.time()
+        Debug("[Notification] Idle, warming plugin cache.")
+        xbmc.executebuiltin('XBMC.RunPlugin("plugin://plugin.video.myshows/?mode=80")')
+
 class myshowsMonitor(xbmc.Monitor):
 
     def __init__(self, *args, **kwargs):
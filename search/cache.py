@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
 
-import os, sys, time, pickle, threading, xbmc, xbmcvfs
+import os, sys, time, zlib, threading, xbmc, xbmcvfs
+from collections import OrderedDict
+from store import bump
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 try:
     from sqlite3 import dbapi2 as sqlite
@@ -9,10 +16,115 @@ except:
 
 rtrCache_lock = threading.RLock();
 
+# записи больше порога сжимаются zlib, первый байт - формат записи
+COMPRESS_MIN = 512
+FORMAT_PICKLE = 'p'
+FORMAT_ZLIB = 'z'
+FORMAT_NONE = 'n'
+
+# "ничего не найдено" по умолчанию храним 3-е суток
+NEGATIVE_TTL = 3*24*60*60
+
+# сколько ждать чужой callback по тому же ключу, прежде чем звать свой
+INFLIGHT_WAIT = 60
+
+# ключи, по которым callback уже запущен: (файл, ключ) -> {'event', 'data'}
+_inflight = {}
+
+# память процесса перед sqlite: не больше записей и байт
+MEMORY_ENTRIES = 500
+MEMORY_SIZE = 4*1024*1024
+
+def pack(obj):
+    if obj is None:
+        return FORMAT_NONE
+    return FORMAT_PICKLE + pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+def unpack(data):
+    data = str(data)
+    if data[0] == FORMAT_ZLIB:
+        return FORMAT_PICKLE + zlib.decompress(data[1:])
+    return data
+
+def compress(data):
+    if len(data) > COMPRESS_MIN:
+        packed = zlib.compress(data[1:])
+        if len(packed) < len(data) - 1:
+            return FORMAT_ZLIB + packed
+    return data
+
+def dumps(obj):
+    return compress(pack(obj))
+
+def loads(data):
+    data = unpack(data)
+    if data[0] == FORMAT_NONE:
+        return None
+    return pickle.loads(data[1:])
+
+class Memory:
+    """
+    LRU последних записей всех Cache процесса. Хранит несжатый pickle,
+    чтобы каждый get получал свою копию объекта.
+    """
+    
+    def __init__(self, entries=MEMORY_ENTRIES, size=MEMORY_SIZE):
+        self.entries = entries
+        self.limit = size
+        self.bytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is not None and item[0] and item[0] < int(time.time()):
+                self.bytes -= len(item[1])
+                item = None
+            if item is None:
+                bump('cache_memory_misses')
+                return None
+            self.items[key] = item
+            bump('cache_memory_hits')
+            return item[1]
+    
+    def put(self, key, expire, data):
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[1])
+            if len(data) > self.limit:
+                return
+            self.items[key] = (expire, data)
+            self.bytes += len(data)
+            while len(self.items) > self.entries or self.bytes > self.limit:
+                key, old = self.items.popitem(last=False)
+                self.bytes -= len(old[1])
+    
+    def drop(self, filename):
+        with self.lock:
+            for key in [x for x in self.items if x[0] == filename]:
+                self.bytes -= len(self.items.pop(key)[1])
+
+_memory = Memory()
+
 class Cache:
-    def __init__(self, name, version, expire=0, size=0, step=100):
+    """
+    
+    API:
+        get      - значение по ключу, при промахе спрашивает callback
+        get_many - свежие значения по списку ключей (None - известный промах)
+        set_many - записать несколько значений одной транзакцией
+        expire   - удалить записи старше expire секунд
+        size     - ужать кэш до size байт
+        flush    - очистить кэш
+        
+    """
+    
+    def __init__(self, name, version, expire=0, size=0, step=100, negative=NEGATIVE_TTL):
         self.name = name
         self.version = version
+        self.negative = negative
         self._connect()
         if expire:
             self.expire(expire)
@@ -20,6 +132,43 @@ class Cache:
             self.size(size, step)
 
     def get(self, token, callback, *param):
+            found, obj = self._lookup(token)
+            if found:
+                return obj
+            
+            # одновременные промахи по одному ключу ждут один callback
+            key = (self.filename, token)
+            with rtrCache_lock:
+                flight = _inflight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = _inflight[key] = {'event': threading.Event()}
+            
+            if not leader:
+                if flight['event'].wait(INFLIGHT_WAIT) and 'data' in flight:
+                    bump('cache_coalesced')
+                    return loads(flight['data'])
+                return callback(*param)[1]
+            
+            try:
+                response = callback(*param)
+                
+                if response[0]:
+                    self.set_many({token: response[1]}, response[0])
+                
+                # ожидающим - своя копия, а не общий объект
+                flight['data'] = dumps(response[1])
+                return response[1]
+            finally:
+                with rtrCache_lock:
+                    _inflight.pop(key, None)
+                flight['event'].set()
+    
+    def _lookup(self, token):
+            data = _memory.get((self.filename, token))
+            if data is not None:
+                return True, loads(data)
+            
             cur = self.db.cursor()
             cur.execute('select expire,data from cache where id=? limit 1', (token, ))
             row = cur.fetchone()
@@ -30,26 +179,65 @@ class Cache:
                     pass
                 else:
                     try:
-                        obj = pickle.loads(row[1])
+                        data = unpack(row[1])
+                        obj = loads(data)
                     except:
                         pass
                     else:
-                        return obj
-            
-            response = callback(*param)
-            
-            if response[0]:
-                obj = sqlite.Binary(pickle.dumps(response[1]))
-                curtime = int(time.time())
-                cur = self.db.cursor()
-                if isinstance(response[0], bool):
-                    cur.execute('replace into cache(id,addtime,expire,data) values(?,?,?,?)', (token, curtime, None, obj))
+                        bump('cache_db_hits')
+                        _memory.put((self.filename, token), row[0], data)
+                        return True, obj
+            bump('cache_db_misses')
+            return False, None
+    
+    def get_many(self, tokens):
+            res, tokens = {}, list(tokens)
+            for token in tokens[:]:
+                data = _memory.get((self.filename, token))
+                if data is not None:
+                    res[token] = loads(data)
+                    tokens.remove(token)
+            cur = self.db.cursor()
+            # не больше 500 ключей в запросе, чтобы не упереться в лимит параметров sqlite
+            for i in range(0, len(tokens), 500):
+                chunk = tokens[i:i + 500]
+                cur.execute('select id,expire,data from cache where id in (' + ','.join(len(chunk)*'?') + ')', chunk)
+                for token, expire, data in cur.fetchall():
+                    if expire and expire < int(time.time()):
+                        continue
+                    try:
+                        data = unpack(data)
+                        res[token] = loads(data)
+                    except:
+                        pass
+                    else:
+                        _memory.put((self.filename, token), expire, data)
+            cur.close()
+            return res
+    
+    def set_many(self, items, expire=True):
+            curtime = int(time.time())
+            if isinstance(expire, bool):
+                expire = None
+            else:
+                expire = curtime + expire
+            rows = []
+            for token, obj in items.items():
+                data = pack(obj)
+                # пустой результат живет свой срок, независимо от expire
+                if obj is None:
+                    row_expire = curtime + self.negative
                 else:
-                    cur.execute('replace into cache(id,addtime,expire,data) values(?,?,?,?)', (token, curtime, curtime + response[0], obj))
-                self.db.commit()
-                cur.close()
-            
-            return response[1]
+                    row_expire = expire
+                _memory.put((self.filename, token), row_expire, data)
+                data = compress(data)
+                rows.append((token, curtime, row_expire, len(data), sqlite.Binary(data)))
+            cur = self.db.cursor()
+            # delete + insert, а не replace: иначе триггер не вычтет размер старой записи
+            cur.executemany('delete from cache where id=?', [(x[0], ) for x in rows])
+            cur.executemany('insert into cache(id,addtime,expire,size,data) values(?,?,?,?,?)', rows)
+            self.db.commit()
+            cur.close()
     
     def expire(self, expire):
         #with rtrCache_lock:
@@ -60,18 +248,25 @@ class Cache:
 
     def size(self, size, step=100):
         #with rtrCache_lock:      
-            while True:
-                if os.path.getsize(self.filename) < size:
-                    break
-                cur = self.db.cursor()
-                cur.execute('select id from cache order by addtime asc limit ?', (step, ))
-                rows = cur.fetchall()
-                if not rows:
-                    cur.close()
-                    break
-                cur.execute('delete from cache where id in (' + ','.join(len(rows)*'?') + ')', [x[0] for x in rows])
-                self.db.commit()
+            cur = self.db.cursor()
+            cur.execute('select bytes from usage')
+            excess = cur.fetchone()[0] - size
+            if excess <= 0:
                 cur.close()
+                return
+            # ищем addtime, до которого старые записи освобождают нужный объем,
+            # и удаляем их одним запросом
+            cutoff = None
+            cur.execute('select addtime,sum(size) from cache group by addtime order by addtime asc')
+            for addtime, bytes in cur:
+                cutoff = addtime
+                excess -= bytes
+                if excess <= 0:
+                    break
+            if cutoff is not None:
+                cur.execute('delete from cache where addtime<=?', (cutoff, ))
+            self.db.commit()
+            cur.close()
 
     def flush(self):
         #with rtrCache_lock:       
@@ -79,6 +274,7 @@ class Cache:
             cur.execute('delete from cache')
             self.db.commit()
             cur.close()
+            _memory.drop(self.filename)
 
     def _connect(self):
         with rtrCache_lock:
@@ -102,10 +298,13 @@ class Cache:
                     row = cur.fetchone()
                     if not row or float(row[0]) != self.version:
                         cur.execute('drop table cache')
+                        cur.execute('drop table if exists usage')
                         cur.execute('drop table if exists db_ver')
                         first = True
                 except:
-                    cur.execute('drop table cache')
+                    cur.execute('drop table if exists cache')
+                    cur.execute('drop table if exists usage')
+                    cur.execute('drop table if exists db_ver')
                     first = True
                 self.db.commit()
                 cur.close()
@@ -113,8 +312,13 @@ class Cache:
             if first:
                 cur = self.db.cursor()
                 cur.execute('pragma auto_vacuum=1')
-                cur.execute('create table cache(id varchar(255) unique, addtime integer, expire integer, data blob)')
+                cur.execute('create table cache(id varchar(255) unique, addtime integer, expire integer, size integer, data blob)')
                 cur.execute('create index time on cache(addtime asc)')
+                # занятый кэшем объем, ведется триггерами
+                cur.execute('create table usage(bytes integer)')
+                cur.execute('insert into usage(bytes) values(0)')
+                cur.execute('create trigger cache_insert after insert on cache begin update usage set bytes=bytes+new.size; end')
+                cur.execute('create trigger cache_delete after delete on cache begin update usage set bytes=bytes-old.size; end')
                 cur.execute('create table db_ver(version real)')
                 cur.execute('insert into db_ver(version) values(?)', (self.version, ))
                 self.db.commit()
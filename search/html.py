@@ -8,37 +8,54 @@ RE = {
     'br': re.compile('<\s*br[\s/]*>', re.U|re.S),
     'inner': re.compile('<[^>]*>[^<]+<\s*/[^>]*>', re.U|re.S),
     'html': re.compile('<[^>]*>', re.U|re.S),
-    'entity': re.compile('&#?\w+;', re.U)
+    'entity': re.compile('(&#?\w+;)', re.U)
 }
 
 UNSUPPORT = {
     '&#151;': '-'
 }
 
+# кэш раскодированных сущностей, неподдерживаемые заданы заранее
+ENTITY = dict(UNSUPPORT)
+ENTITY_MAX = 4096
+
 class Clear:
     def text(self, text, inner=False):
-        text = self._unsupport(text).replace(u'\r', u'\n')
-        text = RE['br'].sub(u'\n', text)
-        if inner:
-            text = RE['inner'].sub(u'', text)
-        text = RE['html'].sub(u'', text)
+        # каждый проход - один C-уровневый sub; проходы, которым нечего
+        # делать, пропускаются по дешевой проверке подстроки
+        if u'\r' in text:
+            text = text.replace(u'\r', u'\n')
+        if u'<' in text:
+            text = RE['br'].sub(u'\n', text)
+            if inner:
+                text = RE['inner'].sub(u'', text)
+            text = RE['html'].sub(u'', text)
         text = self.char(text)
-        text = RE['space'].sub(u' ', text)
-        return RE['cl'].sub(u'\n', text).strip()
+        if u'  ' in text:
+            text = RE['space'].sub(u' ', text)
+        if u'\n\n' in text:
+            text = RE['cl'].sub(u'\n', text)
+        return text.strip()
     
     def string(self, text, space=u''):
         return self.text(text).replace(u'\n', space).strip()
     
     def char(self, text):
-        return RE['entity'].sub(self._unescape, self._unsupport(text))
-    
-    def _unsupport(self, text):
-        for tag, value in UNSUPPORT.iteritems():
-            text = text.replace(tag, value)
-        return text
+        if u'&' not in text:
+            return text
+        # split оставляет сущности на нечетных местах
+        parts = RE['entity'].split(text)
+        for i in xrange(1, len(parts), 2):
+            entity = parts[i]
+            try:
+                parts[i] = ENTITY[entity]
+            except KeyError:
+                parts[i] = self._unescape(entity)
+                if len(ENTITY) < ENTITY_MAX:
+                    ENTITY[entity] = parts[i]
+        return u''.join(parts)
     
-    def _unescape(self, m):
-        text = m.group(0)
+    def _unescape(self, text):
         if text[:2] == u"&#":
             try:
                 if text[:3] == u"&#x":
@@ -1,9 +1,46 @@
 # -*- coding: utf-8 -*-
 
-import re, time, urllib, os, tempfile, zipfile
+import re, time, urllib, os, zipfile
 from net import HTTP
 from cache import Cache
 
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+# теги <Series>, которые попадают в info: (ключ, тег, тип)
+SERIES_FIELDS = (
+    ('plot', 'Overview', None),
+    ('mpaa', 'ContentRating', None),
+    ('premiered', 'FirstAired', None),
+    ('studio', 'Network', None),
+    ('title', 'SeriesName', None),
+    ('runtime', 'Runtime', None),
+    ('votes', 'RatingCount', None),
+    ('rating', 'Rating', float),
+    ('genre', 'Genre', unicode),
+    ('cast', 'Actors', list)
+)
+
+TRANSLIT = dict(zip(u'абвгдеёжзийклмнопрстуфхцчшщъыьэюя', (
+    'a', 'b', 'v', 'g', 'd', 'e', 'e', 'zh', 'z', 'i', 'i', 'k', 'l', 'm', 'n', 'o', 'p',
+    'r', 's', 't', 'u', 'f', 'kh', 'ts', 'ch', 'sh', 'shch', '', 'y', '', 'e', 'yu', 'ya'
+)))
+
+RE_NONWORD = re.compile(r'\W+', re.U)
+
+def normalize(title):
+    """ Ключ индекса названий: регистр, пунктуация, артикль и кириллица не важны. """
+    if not isinstance(title, unicode):
+        title = title.decode('utf-8', 'ignore')
+    title = title.lower().replace(u'&', u' and ')
+    title = u''.join([TRANSLIT.get(x, x) for x in title])
+    title = u' '.join(RE_NONWORD.sub(u' ', title).split())
+    if title.startswith(u'the '):
+        title = title[4:]
+    return title
+
 class TvDb:
     """
     
@@ -11,13 +48,21 @@ class TvDb:
         scraper  - скрапер
         search   - поиск сериалов
         movie    - профайл фильма
+        banners  - баннеры сериала
         
     """
     
+    # архив сериала качаем не чаще раза в сутки
+    BUNDLE_TTL = 24*60*60
+    
+    # предел tvdb.db, старые записи вытесняются
+    CACHE_SIZE = 10*1024*1024
+    
     def __init__(self):
         self.api_key = '33DBB309BB2B0ADB'
         
-        self.cache = Cache('tvdb.db', 1.0)
+        # 3.0: artwork: сгруппирован по сезону, типу и языку вместо списка banners:
+        self.cache = Cache('tvdb.db', 3.0, size=self.CACHE_SIZE)
         
         self.http = HTTP()
         self.headers = {
@@ -53,52 +98,36 @@ class TvDb:
             return self.movie(id)
 
     def get_banners(self, id):
-        import xml.etree.ElementTree as ET
-        dirname = tempfile.mkdtemp()
-        response = self.http.fetch('http://www.thetvdb.com/api/' + self.api_key + '/series/' + str(id) + '/all/ru.zip', headers=self.headers, download=os.path.join(dirname, 'movie.zip'))
-        if response.error:
-            self._movie_clear(dirname)
-            return False, None
-
-        try:
-            filezip = zipfile.ZipFile(os.path.join(dirname, 'movie.zip'), 'r')
-            filezip.extractall(dirname)
-            filezip.close()
-            movie = file(os.path.join(dirname, 'banners.xml'), 'rb').read().decode('utf8')
-        except:
-            self._movie_clear(dirname)
+        id = str(id)
+        return self.cache.get('artwork:' + id, self._banners, id)
+    
+    
+    def _banners(self, id):
+        movie = self._bundle_read(id, 'banners.xml')
+        if movie is None:
             return False, None
 
-        self._movie_clear(dirname)
-
         dom = ET.fromstring(movie)
         if not len(dom):
-            return
+            return 7*24*60*60, None
 
-        def dom2dict(node):
-            ret = {}
-            for child in node:
-                if len(child):
-                    ret.setdefault(child.tag.lower(), []).append(dom2dict(child))
-                else:
-                    ret[child.tag.lower()] = child.text
-            return ret
+        # баннеры сразу разложены по сезонам, типам и языкам
+        res = {'season': {}, 'type': {}, 'language': {}}
+        for banner in dom.findall('Banner'):
+            path = banner.findtext('BannerPath')
+            if not path:
+                continue
+            url = 'http://www.thetvdb.com/banners/' + path
+            bannertype = banner.findtext('BannerType')
+            res['type'].setdefault(bannertype, []).append(url)
+            res['language'].setdefault(banner.findtext('Language'), []).append(url)
+            if bannertype == 'season':
+                try:
+                    res['season'].setdefault(int(banner.findtext('Season')), []).append(url)
+                except (TypeError, ValueError):
+                    pass
 
-        def update_image_urls(meta):
-            if isinstance(meta, dict):
-                for k, v in meta.items():
-                    if isinstance(v, list):
-                        map(update_image_urls, v)
-                    elif isinstance(v, dict):
-                        update_image_urls(v)
-                    elif k in ["banner", "fanart", "poster", "filename", "bannerpath", "vignettepath", "thumbnailpath"] and isinstance(v, basestring):
-                        meta[k] = image_url(v)
-            return meta
-
-        def image_url(fragment):
-            return "%s/banners/%s" % ("http://www.thetvdb.com", fragment)
-
-        return update_image_urls(dom2dict(dom))["banner"]
+        return 7*24*60*60, res
 
     def search(self, name):
         return self._search(name)
@@ -110,28 +139,33 @@ class TvDb:
     
     
     def _movie(self, id):
-        dirname = tempfile.mkdtemp()
-        response = self.http.fetch('http://www.thetvdb.com/api/' + self.api_key + '/series/' + id + '/all/ru.zip', headers=self.headers, download=os.path.join(dirname, 'movie.zip'))
-        if response.error:
-            self._movie_clear(dirname)
+        stream = self._bundle_open(id, 'ru.xml')
+        if stream is None:
             return False, None
         
+        # один проход по ru.xml: поля сериала и режиссеры/сценаристы эпизодов
+        series, people = None, {'director': [], 'writer': []}
         try:
-            filezip = zipfile.ZipFile(os.path.join(dirname, 'movie.zip'), 'r')
-            filezip.extractall(dirname)
-            filezip.close()
-            movie = file(os.path.join(dirname, 'ru.xml'), 'rb').read().decode('utf8')
-        except:
-            self._movie_clear(dirname)
-            return False, None
-        
-        self._movie_clear(dirname)
+            try:
+                for event, elem in ET.iterparse(stream):
+                    if elem.tag in ('Director', 'Writer'):
+                        if elem.text:
+                            people[elem.tag.lower()].extend(elem.text.split('|'))
+                    elif elem.tag == 'Series':
+                        series = dict((x.tag, x.text.strip()) for x in elem if x.text and x.text.strip())
+                        elem.clear()
+                    elif elem.tag == 'Episode':
+                        elem.clear()
+            except SyntaxError:
+                return False, None
+        finally:
+            stream.close()
         
-        body = re.compile(r'<Series>(.+?)</Series>', re.U|re.S).search(movie)
-        if not body:
+        if series is None:
             return False, None
         
-        body = body.group(1)
+        if series.get('SeriesName'):
+            self._remember({series['SeriesName']: int(id)})
         
         res = {
             'icon' : None,
@@ -145,36 +179,21 @@ class TvDb:
         }
         
         # режисеры и сценаристы
-        for tag in ('Director', 'Writer'):
-            people = {}
-            people_list = []
-            [people_list.extend(x.split('|')) for x in re.compile(r'<' + tag + r'>([^<]+)</' + tag + r'>', re.U|re.S).findall(movie)]
-            [people.update({x: 1}) for x in [x.strip() for x in people_list] if x]
-            if people:
-                res['info'][tag.lower()] = u', '.join([x for x in people.keys() if x])
+        for tag, names in people.items():
+            seen = set()
+            names = [x for x in [x.strip() for x in names] if x and not (x in seen or seen.add(x))]
+            if names:
+                res['info'][tag] = u', '.join(names)
         
-        for tag, retag, typeof, targettype in (
-                    ('plot', 'Overview', None, None),
-                    ('mpaa', 'ContentRating', None, None),
-                    ('premiered', 'FirstAired', None, None),
-                    ('studio', 'Network', None, None),
-                    ('title', 'SeriesName', None, None),
-                    ('runtime', 'Runtime', None, None),
-                    ('votes', 'RatingCount', None, None),
-                    ('rating', 'Rating', float, None),
-                    ('genre', 'Genre', list, unicode),
-                    ('cast', 'Actors', list, None)
-                    ):
-            r = re.compile(r'<' + retag + r'>([^<]+)</' + retag + r'>', re.U|re.S).search(body)
+        for tag, retag, typeof in SERIES_FIELDS:
+            r = series.get(retag)
             if r:
-                r = r.group(1).strip()
                 if typeof == float:
                     res['info'][tag] = float(r)
+                elif typeof == unicode:
+                    res['info'][tag] = u', '.join([x for x in [x.strip() for x in r.split(u'|')] if x])
                 elif typeof == list:
-                    if targettype == unicode:
-                        res['info'][tag] = u', '.join([x for x in [x.strip() for x in r.split(u'|')] if x])
-                    else:
-                        res['info'][tag] = [x for x in [x.strip() for x in r.split(u'|')] if x]
+                    res['info'][tag] = [x for x in [x.strip() for x in r.split(u'|')] if x]
                 else:
                     res['info'][tag] = r
         
@@ -183,15 +202,13 @@ class TvDb:
             res['info']['year'] = int(res['info']['premiered'].split('-')[0])
         
         # постер
-        r = re.compile(r'<poster>([^<]+)</poster>', re.U|re.S).search(body)
-        if r:
-            res['icon'] = 'http://thetvdb.com/banners/' + r.group(1).strip()
-            res['thumbnail'] = 'http://thetvdb.com/banners/' + r.group(1).strip()
+        if series.get('poster'):
+            res['icon'] = 'http://thetvdb.com/banners/' + series['poster']
+            res['thumbnail'] = 'http://thetvdb.com/banners/' + series['poster']
         
         # фанарт
-        r = re.compile(r'<fanart>([^<]+)</fanart>', re.U|re.S).search(body)
-        if r:
-            res['properties']['fanart_image'] = 'http://thetvdb.com/banners/' + r.group(1).strip()
+        if series.get('fanart'):
+            res['properties']['fanart_image'] = 'http://thetvdb.com/banners/' + series['fanart']
         
         timeout = True
         # если фильм свежий, то кладем в кэш НЕ на долго (могут быть обновления на сайте)
@@ -201,18 +218,66 @@ class TvDb:
         return timeout, res
             
     
-    def _movie_clear(self, dirname):
-        for filename in os.listdir(dirname):
+    def _bundle(self, id):
+        filename = os.path.join(os.path.dirname(self.cache.filename), 'tvdb_' + id + '.zip')
+        if os.path.isfile(filename) and time.time() - os.path.getmtime(filename) < self.BUNDLE_TTL:
+            return filename
+        response = self.http.fetch('http://www.thetvdb.com/api/' + self.api_key + '/series/' + id + '/all/ru.zip', headers=self.headers, download=filename)
+        if response.error:
+            # устаревший архив лучше, чем ничего
+            return filename if os.path.isfile(filename) else None
+        return filename
+    
+    
+    def _bundle_read(self, id, name):
+        filename = self._bundle(id)
+        if not filename:
+            return None
+        try:
+            filezip = zipfile.ZipFile(filename, 'r')
             try:
-                os.unlink(os.path.join(dirname, filename))
-            except:
-                raise
+                return filezip.read(name)
+            finally:
+                filezip.close()
+        except:
+            return None
+    
+    
+    def _bundle_open(self, id, name):
+        # поток файла из архива, без распаковки целиком в память
+        filename = self._bundle(id)
+        if not filename:
+            return None
         try:
-            os.rmdir(dirname)
+            filezip = zipfile.ZipFile(filename, 'r')
+            try:
+                return filezip.open(name)
+            finally:
+                filezip.close()
         except:
-            raise
+            return None
         
     
+    def _index(self, search):
+        # seriesid по нормализованным названиям, без обращения к сайту
+        keys = ['title:' + normalize(x) for x in search if x]
+        found = self.cache.get_many(keys)
+        for key in keys:
+            if found.get(key):
+                return found[key]
+        return None
+    
+    
+    def _remember(self, titles, override=False):
+        # дополняем индекс названий; уже известные названия переписывает только override
+        titles = dict(('title:' + normalize(k), v) for k, v in titles.items() if k and normalize(k))
+        if not override:
+            known = self.cache.get_many(titles.keys())
+            titles = dict((k, v) for k, v in titles.items() if not known.get(k))
+        if titles:
+            self.cache.set_many(titles)
+    
+    
     def _search(self, search):
         i=-1
         for name in search:
@@ -223,9 +288,8 @@ class TvDb:
         
             res = []
             rows = re.compile('<Series>(.+?)</Series>', re.U|re.S).findall(response.body.decode('utf8'))
+            recmd = re.compile('<seriesid>([0-9]+)</seriesid>', re.U|re.S)
             if rows:
-                recmd = re.compile('<seriesid>([0-9]+)</seriesid>', re.U|re.S)
-            
                 for row in [x for x in rows if x.find(u'<language>ru</language>') != -1]:
                     r = recmd.search(row)
                     if r:
@@ -239,6 +303,18 @@ class TvDb:
                             res.append(int(r.group(1)))
 
             if res:
+                # в индекс попадают запрос и названия только выбранного сериала:
+                # синонимы остальных кандидатов указали бы не на тот id, что вернул бы сайт
+                titles = {name: res[0]}
+                for row in rows:
+                    r = recmd.search(row)
+                    if r and int(r.group(1)) == res[0]:
+                        for retag in ('SeriesName', 'AliasNames'):
+                            names = re.compile('<' + retag + '>([^<]+)</' + retag + '>', re.U|re.S).search(row)
+                            if names:
+                                for x in names.group(1).split(u'|'):
+                                    titles[x.strip()] = res[0]
+                self._remember(titles, override=True)
                 break
                 
         return {'pages': (1, 0, 1, 0), 'data': res}
@@ -251,14 +327,18 @@ class TvDb:
         if year and year >= time.gmtime(time.time()).tm_year:
             timeout = 7*24*60*60 #week
         
+        id = self._index(name)
+        if id:
+            return timeout, id
+        
         ids = self._search(name)
         
         if ids is None:
             return False, None
         
         elif not ids['data']:
-            # сохраняем пустой результат на 3-е суток
-            return 259200, None
+            # пустой результат, срок хранения задает Cache(negative=...)
+            return True, None
         
         else:
             return timeout, ids['data'][0]
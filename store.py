@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os, sys, threading
+import xbmc, xbmcvfs
+
+try:
+    from sqlite3 import dbapi2 as sqlite
+except:
+    from pysqlite2 import dbapi2 as sqlite
+
+store_lock = threading.RLock()
+
+SCHEMA = (
+    'create table if not exists sources(addtime integer, filename varchar(32) PRIMARY KEY, showId integer, seasonId integer, episodeId integer, id integer, stype varchar(32))',
+    'create table if not exists cache(addtime integer, url varchar(32))',
+    'create table if not exists scan(addtime integer, filename varchar(32) PRIMARY KEY)',
+    'create table if not exists watched(addtime integer, rating integer, id varchar(32) PRIMARY KEY)',
+    'create table if not exists counters(name varchar(32) PRIMARY KEY, value integer)',
+    'create table if not exists recent(showId integer PRIMARY KEY, addtime integer)',
+    'create index if not exists sources_show on sources(showId, seasonId, id)',
+    'create index if not exists cache_url on cache(url)',
+    'create index if not exists scan_filename on scan(filename)',
+)
+
+class Store:
+    """
+    One long-lived connection to data.db3 per process, shared by
+    CacheDB, TorrentDB, ScanDB and WatchedDB. It also holds the counters
+    table behind bump/flush/counters and the recent table of opened shows
+    that cache warming reads.
+
+    API:
+        fetchone - first row of a select
+        fetchall - all rows of a select
+        execute  - run a statement and commit
+        batch    - run (sql, args) pairs in one transaction, commit once
+
+    Module functions:
+        store    - the Store of this process
+        bump     - add to a counter in memory
+        flush    - write the bumped counters in one transaction
+        counters - stored counter totals by name
+    """
+
+    connects = 0
+
+    def __init__(self):
+        self.filename = self.dbfilename()
+        self._connect()
+
+    def fetchone(self, sql, args=()):
+        with store_lock:
+            cur = self.db.cursor()
+            cur.execute(sql, args)
+            row = cur.fetchone()
+            cur.close()
+        return row
+
+    def fetchall(self, sql, args=()):
+        with store_lock:
+            cur = self.db.cursor()
+            cur.execute(sql, args)
+            rows = cur.fetchall()
+            cur.close()
+        return rows
+
+    def execute(self, sql, args=()):
+        with store_lock:
+            cur = self.db.cursor()
+            cur.execute(sql, args)
+            count = cur.rowcount
+            self.db.commit()
+            cur.close()
+        return count
+
+    def batch(self, statements):
+        with store_lock:
+            cur = self.db.cursor()
+            try:
+                for sql, args in statements:
+                    cur.execute(sql, args)
+                self.db.commit()
+            except:
+                self.db.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def dbfilename(self):
+        dirname = xbmc.translatePath('special://temp')
+        for subdir in ('xbmcup', sys.argv[0].replace('plugin://', '').replace('/', '')):
+            dirname = os.path.join(dirname, subdir)
+            if not xbmcvfs.exists(dirname):
+                xbmcvfs.mkdir(dirname)
+        return os.path.join(dirname, 'data.db3')
+
+    def _connect(self):
+        with store_lock:
+            first = not xbmcvfs.exists(self.filename)
+            self.db = sqlite.connect(self.filename, check_same_thread=False, timeout=10)
+            Store.connects += 1
+            cur = self.db.cursor()
+            if first:
+                cur.execute('pragma auto_vacuum=1')
+            try:
+                cur.execute('pragma journal_mode=WAL')
+            except sqlite.Error:
+                pass
+            cur.execute('pragma synchronous=NORMAL')
+            for sql in SCHEMA:
+                cur.execute(sql)
+            self.db.commit()
+            cur.close()
+
+_store = None
+
+def store():
+    global _store
+    with store_lock:
+        if _store is None:
+            _store = Store()
+    return _store
+
+_counters = {}
+
+def bump(name, n=1):
+    with store_lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+def flush():
+    with store_lock:
+        if not _counters:
+            return
+        items = _counters.items()
+        _counters.clear()
+        statements = []
+        for name, n in items:
+            statements.append(('insert or ignore into counters(name, value) values(?,0)', (name,)))
+            statements.append(('update counters set value=value+? where name=?', (n, name)))
+        store().batch(statements)
+
+def counters():
+    return dict(store().fetchall('select name, value from counters'))
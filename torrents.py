@@ -34,7 +34,6 @@ __settings__ = xbmcaddon.Addon(id='plugin.video.myshows')
 __language__ = __settings__.getLocalizedString
 ruName=__settings__.getSetting("ruName")
 cookie_auth=__settings__.getSetting("cookie_auth")
-socket.setdefaulttimeout(30)
 __addonpath__= __settings__.getAddonInfo('path')
 icon   = __addonpath__+'/icon.png'
 __tmppath__= os.path.join(__addonpath__, 'tmp')
@@ -56,159 +55,74 @@ except: aceport=62062
 
 
 class TorrentDB:
-    def __init__(self):
-        dirname = xbmc.translatePath('special://temp')
-        for subdir in ('xbmcup', sys.argv[0].replace('plugin://', '').replace('/', '')):
-            dirname = os.path.join(dirname, subdir)
-            if not xbmcvfs.exists(dirname):
-                xbmcvfs.mkdir(dirname)
-        self.dbfilename = os.path.join(dirname, 'data.db3')
-        if not xbmcvfs.exists(self.dbfilename):
-            creat_db(self.dbfilename)
+    columns='select filename, stype, showId, seasonId, id, episodeId from sources'
 
     def get_all(self, noid=False, showId=None, seasonId=None, noseasonId=False):
-        self._connect()
-        if not showId: self.where=''
-        else:
-            self.where=' where showId='+str(showId)
-            if seasonId: self.where+=' and seasonId='+str(seasonId)
-            elif noseasonId==True: self.where+=' and seasonId is null'
-            if noid: self.where+=' and id is null'
-        self.cur.execute('select filename, stype, showId, seasonId, id, episodeId from sources'+self.where+' order by addtime desc')
-        res = [{'filename': x[0], 'stype': x[1], 'showId': x[2], 'seasonId': x[3], 'id': x[4], 'episodeId': x[5]} for x in self.cur.fetchall()]
-        self._close()
-        return res
+        where, args='', []
+        if showId:
+            where, args=' where showId=?', [showId]
+            if seasonId:
+                where+=' and seasonId=?'
+                args.append(seasonId)
+            elif noseasonId==True: where+=' and seasonId is null'
+            if noid: where+=' and id is null'
+        return [self._dict(x) for x in store().fetchall(self.columns+where+' order by addtime desc', args)]
 
     def get(self, showId, id=None, seasonId=None, noid=False, noseasonId=False):
-        self._connect()
-        self.where=' where showId='+str(showId)
-        if id: self.where+=' and id='+str(id)
-        elif noid==True: self.where+=' and id is null'
-        if seasonId: self.where+=' and seasonId='+str(seasonId)
-        elif noseasonId==True: self.where+=' and seasonId is null'
-        self.cur.execute('select filename, stype, showId, seasonId, id, episodeId from sources'+self.where)
-        try:
-            x=self.cur.fetchone()
-            res = {'filename': x[0], 'stype': x[1], 'showId': x[2], 'seasonId': x[3], 'id': x[4], 'episodeId': x[5]}
-        except: res=None
-        self._close()
-        return res
+        where, args=' where showId=?', [showId]
+        if id:
+            where+=' and id=?'
+            args.append(id)
+        elif noid==True: where+=' and id is null'
+        if seasonId:
+            where+=' and seasonId=?'
+            args.append(seasonId)
+        elif noseasonId==True: where+=' and seasonId is null'
+        return self._dict(store().fetchone(self.columns+where, args))
 
     def getbyfilename(self, filename):
-        self._connect()
-        if not '"' in list(filename):
-            self.where=' where filename="'+filename+'"'
-        else:
-            self.where=" where filename='"+filename+"'"
-        self.cur.execute('select filename, stype, showId, seasonId, id, episodeId from sources'+self.where)
-        x=self.cur.fetchone()
-        try: res = {'filename': x[0], 'stype': x[1], 'showId': x[2], 'seasonId': x[3], 'id': x[4], 'episodeId': x[5]}
-        except: res=None
-        self._close()
-        return res
+        return self._dict(store().fetchone(self.columns+' where filename=?', (filename,)))
 
     def countshowId(self, showId):
-        self._connect()
-        self.where=' where showId='+str(showId)+''
-        self.cur.execute('select count(showId) from sources'+self.where)
-        x=self.cur.fetchone()
-        res=x[0]
-        self._close()
-        return res
+        return store().fetchone('select count(showId) from sources where showId=?', (showId,))[0]
 
     def add(self, filename, stype, showId, seasonId=None, id=None, episodeId=None):
-        self._connect()
-        try:self.cur.execute('insert into sources(addtime, filename, stype, showId, seasonId, id, episodeId) values(?,?,?,?,?,?,?)', (int(time.time()), filename, stype, showId, seasonId, id, episodeId))
-        except: self.cur.execute('insert into sources(addtime, filename, stype, showId, seasonId, id, episodeId) values(?,?,?,?,?,?,?)', (int(time.time()), unicode(filename.decode('utf-8')), stype, showId, seasonId, id, episodeId))
-        self.db.commit()
-        self._close()
+        sql='insert into sources(addtime, filename, stype, showId, seasonId, id, episodeId) values(?,?,?,?,?,?,?)'
+        try: store().execute(sql, (int(time.time()), filename, stype, showId, seasonId, id, episodeId))
+        except: store().execute(sql, (int(time.time()), unicode(filename.decode('utf-8')), stype, showId, seasonId, id, episodeId))
 
     def delete(self, filename):
-        self._connect()
-        if not '"' in list(unicode(filename)):
-            self.cur.execute('delete from sources where filename=("'+unicode(filename)+'")')
-        else:
-            self.cur.execute("delete from sources where filename=('"+unicode(filename)+"')")
-        self.db.commit()
-        self._close()
+        store().execute('delete from sources where filename=?', (unicode(filename),))
 
     def deleteseason(self, showId, seasonId, noid=False):
-        self._connect()
-        self.where=' where showId='+str(showId)+' and seasonId='+str(seasonId)
-        if noid==True: self.where+=' and id is null'
-        else: self.where+=' and id not null'
-        self.cur.execute('select count(filename) from sources'+self.where)
-        self.i=self.cur.fetchone()
-        if self.i[0]>0:
-            self.cur.execute('delete from sources'+self.where)
-            self.db.commit()
-        self._close()
-        return self.i[0]
+        where=' where showId=? and seasonId=?'
+        if noid==True: where+=' and id is null'
+        else: where+=' and id not null'
+        return store().execute('delete from sources'+where, (showId, seasonId))
 
     def deleteshow(self, showId, noseasonId=False):
-        self._connect()
-        self.where=' where showId='+str(showId)
-        if noseasonId==True: self.where+=' and seasonId is null'
-        self.cur.execute('select count(filename) from sources'+self.where)
-        self.i=self.cur.fetchone()
-        if self.i[0]>0:
-            self.cur.execute('delete from sources'+self.where)
-            self.db.commit()
-        self._close()
-        return self.i[0]
-
-    def _connect(self):
-        self.db = sqlite.connect(self.dbfilename)
-        self.cur = self.db.cursor()
-
-    def _close(self):
-        self.cur.close()
-        self.db.close()
+        where=' where showId=?'
+        if noseasonId==True: where+=' and seasonId is null'
+        return store().execute('delete from sources'+where, (showId,))
+
+    def _dict(self, x):
+        if x:
+            return {'filename': x[0], 'stype': x[1], 'showId': x[2], 'seasonId': x[3], 'id': x[4], 'episodeId': x[5]}
 
 class ScanDB(TorrentDB):
     def add(self, filename):
-        self._connect()
-        self.cur.execute('insert into scan(addtime, filename) values(?,?)', (int(time.time()), unicode(filename)))
-        self.db.commit()
-        self._close()
+        store().execute('insert into scan(addtime, filename) values(?,?)', (int(time.time()), unicode(filename)))
 
     def isfilename(self, filename):
-        self._connect()
-        if not '"' in list(unicode(filename)):
-            self.where=' where filename="'+unicode(filename)+'"'
-        else:
-            self.where=" where filename='"+unicode(filename)+"'"
-        try: self.cur.execute('select count(filename) from scan'+self.where)
-        except:
-            self.cur.execute('create table scan(addtime integer, filename varchar(32) PRIMARY KEY)')
-            self.db.commit()
-            self.cur.execute('select count(filename) from scan'+self.where)
-        x=self.cur.fetchone()
-        res=x[0]
-        self._close()
-        if res>0: res=True
-        else: res=False
-        return res
+        return store().fetchone('select count(filename) from scan where filename=?', (unicode(filename),))[0]>0
 
     def get_all(self):
-        self._connect()
         stypelist=['multifile', 'multitorrent','rutracker','nnm','kz']
-        self.where=' where stype="unrealstuff"'
-        for stype in stypelist:
-            self.where+=' OR stype="'+str(stype)+'"'
-        self.cur.execute('select filename, stype, showId, seasonId, id, episodeId from sources'+self.where+' order by addtime desc')
-        res = [{'filename': x[0], 'stype': x[1], 'showId': x[2], 'seasonId': x[3], 'id': x[4], 'episodeId': x[5]} for x in self.cur.fetchall()]
-        self._close()
-        return res
+        where=' where stype in ('+','.join('?'*len(stypelist))+')'
+        return [self._dict(x) for x in store().fetchall(self.columns+where+' order by addtime desc', stypelist)]
 
     def delete(self, filename):
-        self._connect()
-        if not '"' in list(unicode(filename)):
-            self.cur.execute('delete from scan where filename=("'+unicode(filename)+'")')
-        else:
-            self.cur.execute("delete from scan where filename=('"+unicode(filename)+"')")
-        self.db.commit()
-        self._close()
+        store().execute('delete from scan where filename=?', (unicode(filename),))
 
 class Source:
     def __init__(self, stringdata=None):
@@ -417,8 +331,7 @@ class Source:
                 else: ret=0
                 if ret!=None:
                     myshows_temp=chooseDir(myshows_temp, unicode(chooseDir(myshows_temp)[ret]))
-                    data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(self.showId))
-                    jdata = json.loads(data.get())
+                    model = show_model(self.showId)
 
                     if len(myshows_temp)>1: cutlist=cutFileNames(myshows_temp)
                     else: cutlist=myshows_temp
@@ -429,12 +342,10 @@ class Source:
                         if not self.seasonId and not x[0]:
                             break
                         else:
-                            for id in jdata['episodes']:
-                                if jdata['episodes'][id]['seasonNumber']==x[0] and jdata['episodes'][id]['episodeNumber']==x[1] \
-                                    or not x[0] and jdata['episodes'][id]['seasonNumber']==self.seasonId and jdata['episodes'][id]['episodeNumber']==x[1]:
-                                    self.id=int(id)
-                                    doit=True
-                                    break
+                            id=model.by_se.get((x[0] or self.seasonId, x[1]))
+                            if id:
+                                self.id=int(id)
+                                doit=True
                             self.filename=myshows_files[myshows_items_indexes[myshows_temp[cutlist.index(fn)]]]
                             if not TorrentDB().getbyfilename(self.filename) and doit:
                                 try:
@@ -461,8 +372,7 @@ class Source:
     def addmultifile(self):
         i=0
         filename=self.filename
-        data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(self.showId))
-        jdata = json.loads(data.get())
+        model = show_model(self.showId)
         dirlist=getDirList(filename)
         if len(dirlist)>1: cutlist=cutFileNames(dirlist)
         else: cutlist=dirlist
@@ -476,12 +386,10 @@ class Source:
                 if not self.seasonId and not x[0]:
                     break
                 else:
-                    for id in jdata['episodes']:
-                        if jdata['episodes'][id]['seasonNumber']==x[0] and jdata['episodes'][id]['episodeNumber']==x[1] \
-                            or not x[0] and jdata['episodes'][id]['seasonNumber']==self.seasonId and jdata['episodes'][id]['episodeNumber']==x[1]:
-                            self.id=int(id)
-                            doit=True
-                            break
+                    id=model.by_se.get((x[0] or self.seasonId, x[1]))
+                    if id:
+                        self.id=int(id)
+                        doit=True
                     if not TorrentDB().getbyfilename(self.filename) and doit:
                         try:
                             if x[0]:seasonId=x[0]
@@ -671,7 +579,8 @@ def chooseHASH(showId=None, id=None, seasonId=None, episodeId=None):
 class Serialu(Source):
     def handle(self):
         self.data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(self.showId))
-        self.jdata = json.loads(self.data.get())
+        self.model = self.data.model()
+        self.jdata = self.model.jdata
         self.name=self.jdata['ruTitle']
         if not self.name: self.name=self.jdata['title']
         self.stringdata=urllib.quote_plus('{"stype":"serialu", "showId":'+jstr(self.showId)+', "episodeId":'+jstr(self.episodeId)+', "id":'+jstr(self.id)+', "seasonId":'+jstr(self.seasonId)+'}')
@@ -706,11 +615,9 @@ class Serialu(Source):
             self.filename=getjdata['filename']
             self.stype='serialu-file'
             self.episodeId=getjdata['episodeId']
-            for id in self.jdata['episodes']:
-                #if not self.seasonId: self.seasonId=getjdata['seasonId']
-                if self.jdata['episodes'][id]['seasonNumber']==getjdata['seasonId'] and self.jdata['episodes'][id]['episodeNumber']==getjdata['episodeId']:
-                    self.id=int(id)
-                    break
+            id=self.model.by_se.get((getjdata['seasonId'], getjdata['episodeId']))
+            if id:
+                self.id=int(id)
             if not self.getfilename():
                 try:
                     TorrentDB().add(urllib.unquote_plus(self.filename), self.stype, self.showId, getjdata['seasonId'], self.id, self.episodeId)
@@ -732,9 +639,8 @@ class AddSource(Source):
             if self.id:
                 myshows_titles=[__language__(30291),__language__(30239), __language__(30240), __language__(30241), __language__(30242), __language__(30273), __language__(30274), __language__(30243)]
                 myshows_items=['torrenterall','file', 'vk-file', 'lostfilm', 'torrent', 'tpb', 'utorrent', None]
-                socket.setdefaulttimeout(1)
                 try:
-                    if 'lostfilm' in get_url(cookie_auth, 'http://myshows.ru/int/controls/view/episode/'+str(self.id)+'/'):
+                    if 'lostfilm' in get_url(cookie_auth, 'http://myshows.ru/int/controls/view/episode/'+str(self.id)+'/', timeout=1):
                         myshows_titles[3]=__language__(30514)
                 except:pass
             else:
@@ -1062,8 +968,7 @@ class ShowAllSources(Source):
 
 def VKSearch(showId, id):
     PluginStatus().use('vkstatus')
-    data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).get()
-    jdata = json.loads(data)
+    jdata = Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).json()
 
     id=str(id)
     t=jdata['title']
@@ -1099,8 +1004,7 @@ def VKSearch(showId, id):
 
 def LFSearch(showId, id):
     PluginStatus().use('lostfilm')
-    data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).get()
-    jdata = json.loads(data)
+    jdata = Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(showId)).json()
 
     id=str(id)
     t=jdata['title']
@@ -1113,8 +1017,7 @@ def LFSearch(showId, id):
 
     lostlink=None
     LFshowId=None
-    socket.setdefaulttimeout(3)
-    int_html=get_url(cookie_auth, 'http://myshows.ru/int/controls/view/episode/'+id+'/')
+    int_html=get_url(cookie_auth, 'http://myshows.ru/int/controls/view/episode/'+id+'/', timeout=3)
     if 'lostfilm' in int_html:
         try:lostlink=re.findall('<a.*?href=\"(http://lostfilm.tv/.*?)\">', int_html)[0]
         except: pass
@@ -1148,8 +1051,7 @@ class TorrenterSearch():
             self.handle()
 
     def handle(self):
-        data= Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(self.showId)).get()
-        jdata = json.loads(data)
+        jdata = Data(cookie_auth, 'http://api.myshows.ru/shows/'+str(self.showId)).json()
 
         if self.id:
             id=str(self.id)
@@ -1382,8 +1284,7 @@ class MoveToXBMC(Source):
         return os.path.join(self.xbmclib, dirs)
 
     def uTorrentCheck(self, folder, action):
-        socket.setdefaulttimeout(3)
-        ulist=Download().list()
+        ulist=Download(timeout=3).list()
         if ulist:
             utordirs=[]
             for data in ulist: utordirs.append((data['id'], data['name']))
@@ -1421,9 +1322,46 @@ def chooseDir(urls, path=None):
                     files.append(url)
         return files
 
-def prefix(showId=None, seasonId=None, id=None, stype=None, episodeNumber=None):
-    if not stype:
+class PrefixIndex:
+    """
+    All sources rows for a listing loaded in one query, so prefix() can
+    answer every row without hitting the db again.
+    """
+
+    def __init__(self, showIds=None):
+        self.by_key, self.by_id, self.by_season = {}, {}, {}
+        sql='select showId, seasonId, id, stype from sources'
+        args=[]
+        if showIds is not None:
+            args=[int(x) for x in showIds]
+            if not args: return
+            sql+=' where showId in ('+','.join('?'*len(args))+')'
+        for showId, seasonId, id, stype in store().fetchall(sql+' order by rowid', args):
+            self.by_key.setdefault((showId, seasonId or None, id or None), stype)
+        for showId, seasonId, id, stype in store().fetchall(sql+' order by addtime desc', args):
+            if id: self.by_id[id]=stype
+            if seasonId: self.by_season[seasonId]=stype
+
+    def get(self, showId=None, seasonId=None, id=None):
         if showId:
+            return self.by_key.get((showId, seasonId or None, id or None))
+        elif id:
+            return self.by_id.get(id)
+        elif seasonId:
+            return self.by_season.get(seasonId)
+
+def stype_prefix(stype):
+    stypes=['json', 'vk-file', 'url-file', 'btchat', 'dir', 'file', 'torrent', 'multifile', 'multitorrent','serialu-file','serialu','rutracker','tpb','nnm','kz', 'torrenter','xbmc','lostfilm']
+    prefixes=['JS', 'VK', 'UF', 'BT', 'D', 'F', 'T', 'MF', 'MT','SF','SU','RU','PB','NN','KZ','TR','XBMC','LF']
+    if stype:
+        return '[B][%s][/B] ' %(prefixes[stypes.index(stype)])
+    return ''
+
+def prefix(showId=None, seasonId=None, id=None, stype=None, episodeNumber=None, index=None):
+    if not stype:
+        if index:
+            stype=index.get(showId, seasonId, id)
+        elif showId:
             getdict=TorrentDB().get(showId=showId, seasonId=seasonId, id=id, noid=True, noseasonId=invert_bool(seasonId))
             try: stype=getdict['stype']
             except: pass
@@ -1436,13 +1374,7 @@ def prefix(showId=None, seasonId=None, id=None, stype=None, episodeNumber=None):
             #if xbmcEpisode(showId, seasonId, episodeNumber):
             #    stype='xbmc'
             return ''
-    stypes=['json', 'vk-file', 'url-file', 'btchat', 'dir', 'file', 'torrent', 'multifile', 'multitorrent','serialu-file','serialu','rutracker','tpb','nnm','kz', 'torrenter','xbmc','lostfilm']
-    prefixes=['JS', 'VK', 'UF', 'BT', 'D', 'F', 'T', 'MF', 'MT','SF','SU','RU','PB','NN','KZ','TR','XBMC','LF']
-    prefix=None
-    if stype:
-        prefix=('[B][%s][/B] ' %(prefixes[stypes.index(stype)]))
-    if not prefix: prefix=''
-    return prefix
+    return stype_prefix(stype)
 
 def xbmcEpisode(showId, seasonId, episodeNumber):
     from utilities import xbmcJsonRequest